@@ -0,0 +1,416 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+import argparse
+import numpy as np
+import pandas as pd
+
+from profits import ProfitCalculator, TradeHistory, csv_types, tx_types, wallets, list_sources, read_history
+from exchanges import bitflyer
+
+
+# Timestamps of synthetic transactions start here
+start_time = pd.Timestamp('2017-01-01 00:00:00')
+
+
+def synthetic_times(rng, rows):
+    seconds = np.sort(rng.integers(0, 3 * 365 * 24 * 3600, size=rows))
+    return (start_time + pd.to_timedelta(seconds, unit='s')).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def synthetic_frame(type, rows, seed=0):
+    # Raw export of the given csv type, as the exchange would write it
+    rng = np.random.default_rng(seed)
+    times = synthetic_times(rng, rows)
+    amounts = rng.uniform(0.001, 10, size=rows).round(8)
+    prices = rng.uniform(1, 2000000, size=rows).round(2)
+    fees = rng.uniform(0, 0.01, size=rows).round(8)
+    signed = amounts * rng.choice([-1, 1], size=rows)
+
+    def choice(values):
+        return rng.choice(values, size=rows)
+
+    if type == csv_types['BITFLYER']:
+        # trades are on pairs while deposits and withdrawals are of single currencies
+        pairs = choice(['BTC/JPY', 'ETH/JPY', 'BCH/JPY'])
+        trade = choice([True, False])
+        frame = {
+            '取引日時': times,
+            '通貨': np.where(trade, pairs, choice(['BTC', 'JPY', 'MONA'])),
+            '取引種別': np.where(
+                trade,
+                choice([tx_types['BID'], tx_types['ASK']]),
+                choice([tx_types['DEPOSIT'], tx_types['WITHDRAW']]),
+            ),
+            '価格': prices,
+        }
+        for coin in bitflyer.currencies:
+            frame[coin] = signed
+            frame['手数料(' + coin + ')'] = -fees
+        return pd.DataFrame(frame)
+    elif type == csv_types['BITBANK']:
+        return pd.DataFrame({
+            '取引日時': times,
+            '売/買': choice(['sell', 'buy']),
+            '価格': prices,
+            '通貨ペア': choice(['btc_jpy', 'bcc_jpy', 'bcc_btc', 'mona_jpy', 'mona_btc']),
+            '数量': amounts,
+            '手数料': fees,
+        })
+    elif type == csv_types['BITBANK_DEPOSIT_WITHDRAW'] or type == csv_types['MONAWALLET']:
+        return pd.DataFrame({
+            '日時': times,
+            '種別': choice([tx_types['DEPOSIT'], tx_types['WITHDRAW']]),
+            '金額': amounts,
+            '通貨': choice(['jpy', 'btc', 'mona']),
+            '手数料': fees,
+        })
+    elif type == csv_types['ZAIF_TRADE']:
+        return pd.DataFrame({
+            '日時': times,
+            '取引種別': choice(['bid', 'ask']),
+            '価格': prices,
+            'マーケット': choice(['btc_jpy', 'mona_jpy', 'mona_btc', 'xem_btc']),
+            '数量': amounts,
+            '取引手数料': fees,
+        })
+    elif type == csv_types['ZAIF_DEPOSIT']:
+        return pd.DataFrame({'日時': times, '金額': amounts})
+    elif type == csv_types['ZAIF_ERC20_DEPOSIT']:
+        return pd.DataFrame({'日時': times, '金額': amounts, 'トークン': choice(['ERC20.CMS'])})
+    elif type == csv_types['ZAIF_PURCHASE'] or type == csv_types['BCINFO_PURCHASE']:
+        return pd.DataFrame({'日時': times, '数量': amounts, '通貨': choice(['btc']), '価格': prices})
+    elif type == csv_types['ZAIF_BONUS']:
+        return pd.DataFrame({'支払日時': times, '支払ボーナス': prices})
+    elif type == csv_types['ZAIF_CREDIT_TRADE']:
+        return pd.DataFrame({'決済完了日時': times, '損益（円）': prices})
+    elif type == csv_types['ZAIF_WITHDRAW']:
+        return pd.DataFrame({'日時': times, '金額': amounts, '手数料': fees})
+    elif type == csv_types['MONAPPY']:
+        return pd.DataFrame({'日付': times, '金額': signed, '種別': choice(['受け取り', '送金', '手数料'])})
+    elif type == csv_types['TIPMONA']:
+        return pd.DataFrame({
+            '日付': times,
+            '金額': signed,
+            '種別': choice([tx_types['RECEIVE'], tx_types['SEND']]),
+            '手数料': fees,
+        })
+    elif type == csv_types['ICO']:
+        return pd.DataFrame({'日時': times, '数量': amounts, 'マーケット': choice(['cicc_btc']), '金額': amounts})
+    raise Exception('Unsupported csv type: {}'.format(type))
+
+
+def write_synthetic(directory, rows, seed=0):
+    # Write one synthetic export per csv type and return the paths
+    paths = {}
+    for i, type in enumerate(csv_types.values()):
+        path = os.path.join(directory, type + '.csv')
+        synthetic_frame(type, rows, seed + i).to_csv(path, index=False)
+        paths[type] = path
+    return paths
+
+
+class FakePrices:
+    # Stands in for PriceStore with deterministic prices for every minute, or price if given,
+    # recording the charts asked in charts
+    def __init__(self, price=None):
+        self.price = price
+        self.charts = set()
+
+    def get(self, symbol, exchange, minute):
+        self.charts.add((symbol, exchange))
+        if self.price is not None:
+            return self.price
+        return 1000.0 + (minute // 60 + len(symbol)) % 997
+
+    def put(self, symbol, exchange, minute, price):
+        pass
+
+    def put_many(self, symbol, exchange, prices):
+        pass
+
+
+def write_data_list(directory, files, rows, seed=0):
+    # data_list for load_history with the given number of files, cycling the csv types
+    data_list = {}
+    types = list(csv_types.values())
+    for i in range(files):
+        type = types[i % len(types)]
+        path = os.path.join(directory, '{}_{}.csv'.format(type, i))
+        synthetic_frame(type, rows, seed + i).to_csv(path, index=False)
+        data_list.setdefault(type, []).append({'path': path, 'currency': 'btc'})
+    return data_list
+
+
+def reference_rule(type):
+    # Function of (row, currency) giving the normalized row, as format_data did row by row
+    # with iterrows before the parsers of exchanges/; kept to compare against
+    base = {'price': 0, 'cost': 0, 'profit': 0, 'total_profit': 0}
+    zaif_trade = {'bid': tx_types['ASK'], 'ask': tx_types['BID']}
+    bitbank = {'sell': tx_types['BID'], 'buy': tx_types['ASK']}
+    monappy = {'受け取り': tx_types['RECEIVE'], '送金': tx_types['SEND'], '手数料': tx_types['FEE']}
+
+    def bitflyer_rule(row, currency):
+        if row['通貨'].endswith('/JPY'):
+            coin = row['通貨'].split('/')[0]
+            market = coin.lower() + '_jpy'
+        elif row['通貨'] in bitflyer.currencies:
+            coin = row['通貨']
+            market = coin.lower()
+        return dict(
+            base, time=row['取引日時'], type=row['取引種別'], price=row['価格'], market=market,
+            amount=abs(row[coin]), cost=abs(row.get('手数料(' + coin + ')', 0)), exchange=wallets['BF'],
+        )
+
+    rules = {
+        csv_types['BITFLYER']: bitflyer_rule,
+        csv_types['BITBANK']: lambda row, currency: dict(
+            base, time=row['取引日時'], type=bitbank[row['売/買']], price=row['価格'],
+            market={'bcc_btc': 'bch_btc', 'bcc_jpy': 'bch_jpy'}.get(row['通貨ペア'], row['通貨ペア']),
+            amount=row['数量'], cost=row['手数料'], exchange=wallets['BITBANK'],
+        ),
+        csv_types['BITBANK_DEPOSIT_WITHDRAW']: lambda row, currency: dict(
+            base, time=row['日時'], type=row['種別'], amount=row['金額'], market=row['通貨'],
+            cost=row['手数料'], exchange=wallets['BITBANK'],
+        ),
+        csv_types['ZAIF_TRADE']: lambda row, currency: dict(
+            base, time=row['日時'], type=zaif_trade[row['取引種別']], price=row['価格'], market=row['マーケット'],
+            amount=row['数量'], cost=row['取引手数料'], exchange=wallets['ZAIF'],
+        ),
+        csv_types['ZAIF_DEPOSIT']: lambda row, currency: dict(
+            base, time=row['日時'], amount=row['金額'], market=currency, type=tx_types['DEPOSIT'],
+            exchange=wallets['ZAIF'],
+        ),
+        csv_types['ZAIF_ERC20_DEPOSIT']: lambda row, currency: dict(
+            base, time=row['日時'], amount=row['金額'], market=row['トークン'].lower(), type=tx_types['DEPOSIT'],
+            exchange=wallets['ZAIF'],
+        ),
+        csv_types['ZAIF_PURCHASE']: lambda row, currency: dict(
+            base, time=row['日時'], amount=row['数量'], market=row['通貨'], type=tx_types['PURCHASE'],
+            cost=row['価格'], exchange=wallets['ZAIF'],
+        ),
+        csv_types['BCINFO_PURCHASE']: lambda row, currency: dict(
+            base, time=row['日時'], amount=row['数量'], market=row['通貨'], type=tx_types['PURCHASE'],
+            cost=row['価格'], exchange=wallets['BLOCKCHAIN.INFO'],
+        ),
+        csv_types['ZAIF_BONUS']: lambda row, currency: dict(
+            base, time=row['支払日時'], amount=row['支払ボーナス'], market='jpy', type=tx_types['RECEIVE'],
+            exchange=wallets['ZAIF'],
+        ),
+        csv_types['ZAIF_CREDIT_TRADE']: lambda row, currency: dict(
+            base, time=row['決済完了日時'], amount=row['損益（円）'], market='jpy', type=tx_types['RECEIVE'],
+            exchange=wallets['ZAIF'],
+        ),
+        csv_types['ZAIF_WITHDRAW']: lambda row, currency: dict(
+            base, time=row['日時'], amount=row['金額'], market=currency, type=tx_types['WITHDRAW'],
+            cost=row['手数料'], exchange=wallets['ZAIF'],
+        ),
+        csv_types['MONAPPY']: lambda row, currency: dict(
+            base, time=row['日付'], amount=abs(row['金額']), market='mona', type=monappy[row['種別']],
+            exchange=wallets['MONAPPY'],
+        ),
+        csv_types['TIPMONA']: lambda row, currency: dict(
+            base, time=row['日付'], amount=abs(row['金額']), market='mona', type=row['種別'],
+            cost=row['手数料'], exchange=wallets['TIPMONA'],
+        ),
+        csv_types['MONAWALLET']: lambda row, currency: dict(
+            base, time=row['日時'], type=row['種別'], amount=row['金額'], market=row['通貨'],
+            cost=row['手数料'], exchange=wallets['MONAWALLET'],
+        ),
+        csv_types['ICO']: lambda row, currency: dict(
+            base, time=row['日時'], amount=row['数量'], market=row['マーケット'], type=tx_types['ICO'],
+            price=row['金額'], exchange=wallets['ZAIF'],
+        ),
+    }
+    return rules[type]
+
+
+def format_rows(data, type, currency=''):
+    # Reference of TradeHistory.format_data, row by row
+    rule = reference_rule(type)
+    return pd.DataFrame([rule(row, currency) for index, row in data.iterrows()], columns=TradeHistory.columns)
+
+
+def bench_format_data(rows, repeat=3, format=None):
+    # rows per second of every csv type; format is a function as format_rows, or format_data by default
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_synthetic(directory, rows)
+        for type, path in paths.items():
+            data = pd.read_csv(path)
+            trade = TradeHistory()
+            best = None
+            for _ in range(repeat):
+                begin = time.perf_counter()
+                if format is None:
+                    trade.format_data(data, type, 'btc')
+                else:
+                    format(data, type, 'btc')
+                elapsed = time.perf_counter() - begin
+                best = elapsed if best is None else min(best, elapsed)
+            results[type] = rows / best
+    return results
+
+
+def bench_load_history(files, rows, workers=1):
+    with tempfile.TemporaryDirectory() as directory:
+        data_list = write_data_list(directory, files, rows)
+        tracemalloc.start()
+        begin = time.perf_counter()
+        ProfitCalculator().load_history(data_list, workers=workers)
+        elapsed = time.perf_counter() - begin
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_mb': peak / 1024 / 1024}
+
+
+def bench_calculate(files, rows):
+    with tempfile.TemporaryDirectory() as directory:
+        cal = ProfitCalculator(prices=FakePrices(), offline=True)
+        cal.load_history(write_data_list(directory, files, rows))
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        begin = time.perf_counter()
+        cal.calculate(verbosity='none')
+        elapsed = time.perf_counter() - begin
+    return len(cal.trade.data) / elapsed
+
+
+@contextlib.contextmanager
+def stage(results, name, memory=False):
+    # Time the block into results[name]; with memory, also its peak of traced allocations
+    if memory:
+        tracemalloc.start()
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        results[name] = {'seconds': time.perf_counter() - begin}
+        if memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name]['peak_mb'] = peak / 1024 / 1024
+
+
+def bench_stages(files, rows, memory=False):
+    # Ingestion, sort, replay and reporting of one synthetic history, timed separately
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        sources = list_sources(write_data_list(directory, files, rows))
+        cal = ProfitCalculator(prices=FakePrices(), offline=True)
+        with stage(results, 'ingestion', memory):
+            frames = [read_history(source) for source in sources]
+        with stage(results, 'sort', memory):
+            cal.trade.concat_data(frames)
+        del frames
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            with stage(results, 'replay', memory):
+                cal.calculate(verbosity='none')
+            with stage(results, 'reporting', memory):
+                cal.print_status()
+                json.dumps(cal.snapshot())
+                cal.output(os.path.join(directory, 'ledger'))
+    count = len(cal.trade.data)
+    for result in results.values():
+        result['rows_per_second'] = count / result['seconds'] if result['seconds'] > 0 else None
+    return results
+
+
+def commit():
+    # Commit of the working tree, to tell results apart
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(old, new):
+    # Ratio of new to old seconds for every stage in both results; above 1 is slower
+    ratios = {}
+    for name, result in new['stages'].items():
+        if name in old.get('stages', {}) and old['stages'][name]['seconds'] > 0:
+            ratios[name] = result['seconds'] / old['stages'][name]['seconds']
+    return ratios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of profits.py')
+    parser.add_argument('--rows', type=int, default=100000, help='rows per synthetic file')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--reference-rows', type=int, default=10000, help='rows per file for the row-wise reference')
+    parser.add_argument('--files', type=int, default=60, help='number of files for load_history')
+    parser.add_argument('--workers', type=int, default=1, help='processes for load_history')
+    parser.add_argument('--tx-rows', type=int, default=1000, help='rows per file for calculate')
+    parser.add_argument('--stage-files', type=int, default=len(csv_types), help='number of files for the stages')
+    parser.add_argument('--stage-rows', type=int, default=1000, help='rows per file for the stages')
+    parser.add_argument('--memory', action='store_true', help='trace peak memory of every stage (slower)')
+    parser.add_argument('--stages-only', action='store_true', help='only run the stages')
+    parser.add_argument('--generate', help='only write a synthetic export of every csv type of --rows rows here')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run to compare the stages with')
+    args = parser.parse_args()
+
+    if args.generate:
+        os.makedirs(args.generate, exist_ok=True)
+        for type, path in write_synthetic(args.generate, args.rows).items():
+            print(type, path)
+        sys.exit(0)
+
+    results = {
+        'commit': commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'args': vars(args),
+    }
+
+    stages = bench_stages(args.stage_files, args.stage_rows, args.memory)
+    results['stages'] = stages
+    print('stages ({} files x {} rows)'.format(args.stage_files, args.stage_rows))
+    for name, result in stages.items():
+        line = '  {:<10} {:>8.3f} s {:>14,.0f} rows/s'.format(name, result['seconds'], result['rows_per_second'] or 0)
+        if 'peak_mb' in result:
+            line += ', peak {:.1f} MB'.format(result['peak_mb'])
+        print(line)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print('compared with {}'.format(old.get('commit') or args.compare))
+        for name, ratio in compare(old, results).items():
+            print('  {:<10} x{:.2f}'.format(name, ratio))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.stages_only:
+        sys.exit(0)
+
+    results['format_data'] = bench_format_data(args.rows, args.repeat)
+    results['format_rows'] = bench_format_data(args.reference_rows, 1, format=format_rows)
+    print('format_data ({} rows per file), against the row-wise reference ({} rows per file)'.format(
+        args.rows, args.reference_rows))
+    for type, rate in results['format_data'].items():
+        reference = results['format_rows'][type]
+        print('  {:<26} {:>14,.0f} rows/s {:>12,.0f} rows/s x{:.0f}'.format(type, rate, reference, rate / reference))
+
+    result = results['load_history'] = bench_load_history(args.files, args.rows, args.workers)
+    print('load_history ({} files x {} rows, {} workers)'.format(args.files, args.rows, args.workers))
+    print('  {:.2f} s, peak {:.1f} MB'.format(result['seconds'], result['peak_mb']))
+
+    rate = results['calculate'] = bench_calculate(len(csv_types), args.tx_rows)
+    print('calculate ({} files x {} rows)'.format(len(csv_types), args.tx_rows))
+    print('  {:>14,.0f} tx/s'.format(rate))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
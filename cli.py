@@ -0,0 +1,378 @@
+import os
+import sys
+import json
+import argparse
+
+# pandas and requests are imported with profits only by the subcommands which need them,
+# so that --help and argument errors return at once.
+
+# Settings with their defaults. Each can be given in a TOML/JSON config file,
+# where relative paths are from the directory of the file, and overridden by a flag.
+defaults = {
+    # csv type -> list of {path, currency}, as the data_list of ProfitCalculator.load_history
+    'data': None,
+    # directory of csv files whose types are detected; used when data is not given
+    'data_dir': 'csv',
+    'history': 'history',
+    'output': 'results',
+    'ingest_cache': None,
+    'prices': 'prices.sqlite3',
+    'price_dumps': [],
+    'price_fallback': 0,
+    'offline': False,
+    'workers': 1,
+    'concurrency': 4,
+    'rate': 5.0,
+    'verbosity': 'final',
+    # moving_average, total_average or fifo
+    'cost_basis': 'moving_average',
+    # JSON file of coins, wallets, hard forks and Bitbank charts; see profits.read_registry
+    'registry': None,
+    'checkpoints': None,
+    'checkpoint_every': None,
+    # processes replaying the years in parallel from the checkpoints; 1 for a serial replay
+    'year_workers': 1,
+    # csv file of the lots consumed by every sale, written by calculate
+    'lots': None,
+    # rows read at a time by calculate --stream
+    'chunksize': 100000,
+    # directory of <account>.json data lists for batch
+    'accounts': 'accounts',
+    'format': 'text',
+}
+# Settings which are paths
+paths = [
+    'data_dir', 'history', 'output', 'ingest_cache', 'prices', 'price_dumps', 'checkpoints', 'registry',
+    'lots', 'accounts',
+]
+
+
+def read_config(path):
+    # Settings from a .toml or .json file
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise Exception('Reading {} needs Python 3.11 or tomli'.format(path))
+        with open(path, mode='rb') as f:
+            config = tomllib.load(f)
+    else:
+        with open(path) as f:
+            config = json.load(f)
+    unknown = set(config) - set(defaults)
+    if len(unknown) > 0:
+        raise Exception('Unknown settings in {}: {}'.format(path, ', '.join(sorted(unknown))))
+    base = os.path.dirname(os.path.abspath(path))
+    for key in paths:
+        if isinstance(config.get(key), str):
+            config[key] = os.path.join(base, config[key])
+        elif isinstance(config.get(key), list):
+            config[key] = [os.path.join(base, value) for value in config[key]]
+    for items in (config.get('data') or {}).values():
+        for item in items:
+            item['path'] = os.path.join(base, item['path'])
+    return config
+
+
+def settings(args):
+    # defaults, updated by the config file and then by the flags which are given
+    result = dict(defaults)
+    if args.config is not None:
+        result.update(read_config(args.config))
+    for key in defaults:
+        value = getattr(args, key, None)
+        if value is not None and value != []:
+            result[key] = value
+    return result
+
+
+def data_list(config):
+    import profits
+    if config['data'] is not None:
+        return config['data']
+    # currencies in file names are the coins of the registry
+    registry = {} if config['registry'] is None else profits.read_registry(config['registry'])
+    return profits.scan_directory(config['data_dir'], profits.ProfitCalculator.coins + list(registry.get('coins', [])))
+
+
+def calculator(config, **kwargs):
+    import profits
+    prices = profits.PriceStore(config['prices'])
+    if len(config['price_dumps']) > 0:
+        fallback = config['price_fallback']
+        prices = profits.LocalPrices(fallback=None if fallback < 0 else fallback)
+        for path in config['price_dumps']:
+            prices.load(path)
+    registry = None if config['registry'] is None else profits.read_registry(config['registry'])
+    return profits.ProfitCalculator(
+        prices=prices,
+        offline=config['offline'],
+        fetcher=profits.PriceFetcher(concurrency=config['concurrency'], rate=config['rate']),
+        registry=registry,
+        **kwargs
+    )
+
+
+def load_history(cal, config):
+    # History written by ingest
+    if not os.path.exists(os.path.join(config['history'], 'meta.json')):
+        raise Exception('No history in {}; run ingest first'.format(config['history']))
+    cal.trade.load(config['history'])
+
+
+def ingest(config):
+    import profits
+    cal = profits.ProfitCalculator(offline=True)
+    cal.load_history(data_list(config), workers=config['workers'], cache_dir=config['ingest_cache'])
+    cal.trade.save(config['history'])
+    result = {'transactions': len(cal.trade.data), 'history': config['history']}
+    if config['format'] == 'json':
+        print(json.dumps(result, indent=2))
+    else:
+        print('Ingested {transactions} transactions into {history}'.format(**result))
+    return cal
+
+
+def prefetch_prices(config):
+    cal = calculator(config)
+    load_history(cal, config)
+    result = {'requests': cal.prefetch_prices()}
+    if config['format'] == 'json':
+        print(json.dumps(result, indent=2))
+    else:
+        print('Price requests:', result['requests'])
+    return cal
+
+
+def write_lots(f):
+    # on_sale of a calculator writing the lots consumed by every sale to the csv file f
+    import csv
+    import pandas as pd
+    writer = csv.writer(f)
+    writer.writerow(['time', 'market', 'exchange', 'coin', 'lot_time', 'amount', 'price'])
+
+    def on_sale(row, coin, consumed):
+        for lot_time, amount, price in consumed:
+            writer.writerow([
+                row['time'].isoformat(), row['market'], row['exchange'], coin,
+                pd.Timestamp(lot_time, tz='UTC').isoformat(), amount, price,
+            ])
+    return on_sale
+
+
+def calculate(config, resume=False, stream=False):
+    # Writes the transactions with profits and the final state into output for report.
+    # With stream, the csv files are read a chunk at a time instead of the history,
+    # and only the state is written, as profits of transactions are not kept.
+    import shutil
+    import profits
+    cal = calculator(
+        config, checkpoint_dir=config['checkpoints'], cost_basis=config['cost_basis'],
+        track_lots=config['lots'] is not None,
+    )
+    verbosity = config['verbosity'] if config['format'] == 'text' else 'none'
+    lots = None
+    if config['lots'] is not None:
+        lots = open(config['lots'], mode='w', newline='')
+        cal.on_sale = write_lots(lots)
+    if stream:
+        # prices are fetched as they are needed
+        rows = profits.stream_history(data_list(config), chunksize=config['chunksize'], prepare=cal.prepare)
+        cal.calculate_stream(rows, verbosity=verbosity)
+    else:
+        load_history(cal, config)
+        if config['year_workers'] > 1:
+            cal.calculate_years(workers=config['year_workers'], verbosity=verbosity)
+        else:
+            cal.calculate(verbosity=verbosity, checkpoint_every=config['checkpoint_every'], resume=resume)
+    if lots is not None:
+        lots.close()
+    os.makedirs(config['output'], exist_ok=True)
+    ledger = os.path.join(config['output'], 'ledger')
+    if stream:
+        shutil.rmtree(ledger, ignore_errors=True)
+    else:
+        cal.output(ledger)
+    cal.save(os.path.join(config['output'], 'state.pickle'))
+    if config['format'] == 'json':
+        print(json.dumps(cal.snapshot(), indent=2))
+    return cal
+
+
+def compare(config, methods):
+    # Profits under every cost basis method, loading the history and fetching its prices once
+    cal = calculator(config)
+    load_history(cal, config)
+    cal.prefetch_prices()
+    snapshots = cal.compare_cost_bases(methods, workers=config['workers'])
+    if config['format'] == 'json':
+        print(json.dumps(snapshots, indent=2))
+    else:
+        for method, snapshot in snapshots.items():
+            print('-- ', method, ' ---------------------------------')
+            for year, profit in snapshot['profit'].items():
+                print(year, 'Profits:', profit)
+    return cal
+
+
+def total_average(config):
+    # Total-average profits of every year and coin from grouped operations instead of a replay
+    cal = calculator(config)
+    load_history(cal, config)
+    cal.prefetch_prices()
+    table = cal.total_average()
+    if config['format'] == 'json':
+        profit = table.groupby(level='year')['profit'].sum()
+        print(json.dumps({int(year): value for year, value in profit.items()}, indent=2))
+    else:
+        print(table[(table['opening'] != 0) | (table['acquired'] != 0) | (table['sold'] != 0)].to_string())
+    return cal
+
+
+def batch(config):
+    # Calculate every account of accounts into output, sharing the price cache
+    import profits
+    summary = profits.run_batch(
+        config['accounts'], config['output'], workers=config['workers'], prices_path=config['prices'],
+        fetcher=profits.PriceFetcher(concurrency=config['concurrency'], rate=config['rate']),
+    )
+    if config['format'] == 'json':
+        print(json.dumps(summary, indent=2))
+    else:
+        print('{accounts} accounts, {price_requests} price requests, {accounts_per_minute:.1f} accounts/min'.format(**summary))
+
+
+def report(config):
+    # Status of the last calculate, as text, JSON or the transactions as csv
+    import profits
+    cal = profits.ProfitCalculator(offline=True)
+    state = os.path.join(config['output'], 'state.pickle')
+    if not os.path.exists(state):
+        raise Exception('No results in {}; run calculate first'.format(config['output']))
+    cal.load(state)
+    if config['format'] == 'json':
+        print(json.dumps(cal.snapshot(), indent=2))
+    elif config['format'] == 'csv':
+        ledger = os.path.join(config['output'], 'ledger')
+        if not os.path.exists(ledger):
+            raise Exception('No transactions in {}; calculate --stream keeps only the state'.format(config['output']))
+        cal.trade.load(ledger)
+        cal.trade.data.to_csv(sys.stdout, index=False)
+    else:
+        cal.print_status()
+    return cal
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', default=None, help='TOML or JSON file of settings')
+    common.add_argument('--history', default=None, help='directory of the ingested history')
+    common.add_argument('--output', default=None, help='directory of the results of calculate')
+    common.add_argument('--format', default=None, choices=['text', 'json', 'csv'], help='output format')
+    common.add_argument(
+        '--profile', nargs='?', const='summary', default=None, choices=['summary', 'cprofile'],
+        help='print timers, counters and price fetch latencies, or cProfile statistics, to stderr at the end',
+    )
+
+    prices = argparse.ArgumentParser(add_help=False)
+    prices.add_argument('--prices', default=None, help='path of the price cache')
+    prices.add_argument('--offline', action='store_true', default=None, help='use only cached prices')
+    prices.add_argument('--price-dumps', action='append', default=[], help='local OHLC csv/parquet files')
+    prices.add_argument('--price-fallback', type=int, default=None, help='seconds back for an earlier candle')
+    prices.add_argument('--concurrency', type=int, default=None, help='parallel requests to chart APIs')
+    prices.add_argument('--rate', type=float, default=None, help='requests per second to each chart API')
+    prices.add_argument('--registry', default=None, help='JSON file of coins, wallets, hard forks and charts')
+
+    parser = argparse.ArgumentParser(description='Calculate profits in cryptocurrency trading')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('ingest', parents=[common], help='parse csv files into the history')
+    command.add_argument('--data-dir', default=None, help='directory of csv files whose types are detected')
+    command.add_argument('--workers', type=int, default=None, help='processes to parse csv files')
+    command.add_argument('--ingest-cache', default=None, help='directory to cache parsed csv files')
+
+    commands.add_parser(
+        'prefetch-prices', parents=[common, prices], help='fetch every fair value the history needs',
+    )
+
+    command = commands.add_parser('calculate', parents=[common, prices], help='calculate profits of the history')
+    command.add_argument('--verbosity', default=None, choices=['none', 'progress', 'final', 'all'])
+    command.add_argument(
+        '--cost-basis', default=None, choices=['moving_average', 'total_average', 'fifo'],
+        help='method of acquisition costs',
+    )
+    command.add_argument('--checkpoints', default=None, help='directory of checkpoints')
+    command.add_argument('--checkpoint-every', type=int, default=None, help='transactions between checkpoints')
+    command.add_argument('--resume', action='store_true', help='resume from the latest valid checkpoint')
+    command.add_argument(
+        '--year-workers', type=int, default=None,
+        help='processes replaying years in parallel from the checkpoints at their starts, with --checkpoints; '
+        'the first run has no such checkpoints and is one serial job which writes them',
+    )
+    command.add_argument('--lots', default=None, help='csv file to write the lots consumed by every sale')
+    command.add_argument(
+        '--stream', action='store_true', help='read the csv files a chunk at a time instead of the history',
+    )
+    command.add_argument('--chunksize', type=int, default=None, help='rows read at a time with --stream')
+    command.add_argument('--data-dir', default=None, help='directory of csv files whose types are detected')
+
+    command = commands.add_parser(
+        'compare', parents=[common, prices], help='print profits of the history under several cost basis methods',
+    )
+    command.add_argument(
+        '--methods', nargs='+', default=['moving_average', 'total_average', 'fifo'],
+        choices=['moving_average', 'total_average', 'fifo'], help='cost basis methods',
+    )
+    command.add_argument('--workers', type=int, default=None, help='processes replaying the methods')
+
+    commands.add_parser(
+        'total-average', parents=[common, prices],
+        help='print total-average profits of every year and coin from grouped operations instead of a replay',
+    )
+
+    command = commands.add_parser(
+        'batch', parents=[common, prices], help='calculate every account of a directory of data lists',
+    )
+    command.add_argument('--accounts', default=None, help='directory of <account>.json data lists')
+    command.add_argument('--workers', type=int, default=None, help='processes calculating the accounts')
+
+    commands.add_parser('report', parents=[common], help='print the results of calculate')
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    config = settings(args)
+    if args.profile == 'cprofile':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+    # calculator of the command, whose metrics --profile prints
+    cal = None
+    if args.command == 'ingest':
+        cal = ingest(config)
+    elif args.command == 'prefetch-prices':
+        cal = prefetch_prices(config)
+    elif args.command == 'calculate':
+        cal = calculate(config, resume=args.resume, stream=args.stream)
+    elif args.command == 'compare':
+        cal = compare(config, args.methods)
+    elif args.command == 'total-average':
+        cal = total_average(config)
+    elif args.command == 'batch':
+        batch(config)
+    elif args.command == 'report':
+        cal = report(config)
+    if args.profile == 'summary' and cal is not None:
+        cal.metrics.print_summary(file=sys.stderr)
+    elif args.profile == 'cprofile':
+        profiler.disable()
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+
+
+if __name__ == "__main__":
+    main()
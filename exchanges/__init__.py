@@ -0,0 +1,206 @@
+import os
+import csv
+import importlib
+import pandas as pd
+
+
+# global settings
+wallets = {
+    'ZAIF': 'zaif',
+    'BF': 'bitflyer',
+    'BITBANK': 'bitbank',
+    'BLOCKCHAIN.INFO': 'blockchain.info',
+    'TIPMONA': 'tipmona',
+    'MONAPPY': 'monappy',
+    'MONAWALLET': 'mona_wallet',
+}
+tx_types = {
+    'BID': '売り',
+    'ASK': '買い',
+    'RECEIVE': '受取',
+    'WITHDRAW': '出金',
+    'DEPOSIT': '預入',
+    'FEE': '手数料',
+    'SEND': '外部送付',
+    'PURCHASE': '購入',
+    'SELF': '自己',
+    'ICO': 'ICO',
+}
+csv_types = {
+    'ZAIF_TRADE': 'zaif_trade',
+    'ZAIF_CREDIT_TRADE': 'zaif_credit_trade',
+    'ZAIF_DEPOSIT': 'zaif_deposit',
+    'ZAIF_ERC20_DEPOSIT': 'zaif_erc20_deposit',
+    'ZAIF_WITHDRAW': 'zaif_withdraw',
+    'ZAIF_PURCHASE': 'zaif_purchase',
+    'ZAIF_BONUS': 'zaif_bonus',
+    'BCINFO_PURCHASE': 'bcinfo_purchase',
+    'BITFLYER': 'bitflyer',
+    'BITBANK': 'bitbank',
+    'BITBANK_DEPOSIT_WITHDRAW': 'bitbank_deposit_withdraw',
+    'MONAPPY': 'monappy',
+    'MONAWALLET': 'monawallet',
+    'TIPMONA': 'tipmona',
+    'ICO': 'ico',
+}
+# Normalized columns of every transaction
+columns = [
+    'market', 'type', 'price', 'cost', 'amount', 'time',
+    'exchange', 'profit', 'total_profit',
+]
+
+# Module defining the parser of each csv type; imported on first use
+modules = {
+    csv_types['ZAIF_TRADE']: 'exchanges.zaif',
+    csv_types['ZAIF_CREDIT_TRADE']: 'exchanges.zaif',
+    csv_types['ZAIF_DEPOSIT']: 'exchanges.zaif',
+    csv_types['ZAIF_ERC20_DEPOSIT']: 'exchanges.zaif',
+    csv_types['ZAIF_WITHDRAW']: 'exchanges.zaif',
+    csv_types['ZAIF_PURCHASE']: 'exchanges.zaif',
+    csv_types['ZAIF_BONUS']: 'exchanges.zaif',
+    csv_types['ICO']: 'exchanges.zaif',
+    csv_types['BCINFO_PURCHASE']: 'exchanges.blockchain_info',
+    csv_types['BITFLYER']: 'exchanges.bitflyer',
+    csv_types['BITBANK']: 'exchanges.bitbank',
+    csv_types['BITBANK_DEPOSIT_WITHDRAW']: 'exchanges.bitbank',
+    csv_types['MONAPPY']: 'exchanges.monappy',
+    csv_types['MONAWALLET']: 'exchanges.mona_wallet',
+    csv_types['TIPMONA']: 'exchanges.tipmona',
+}
+# Group of entry points through which other packages can add parsers
+entry_point_group = 'profits.parsers'
+# Parsers which are already imported
+parsers = {}
+
+
+class Parser:
+    # How a csv type is read and mapped to the normalized columns.
+    #   schema: columns the csv must have
+    #   column_map: normalized column -> function of (data, currency) giving a column or a scalar
+    #   dtypes: dtypes passed to read_csv
+    #   transform: function of data applied to the whole frame before column_map
+    #   currency: whether the market is given by the currency of the file, not by its rows
+    def __init__(self, type, schema, column_map, dtypes=None, transform=None, currency=False):
+        self.type = type
+        self.schema = schema
+        self.column_map = column_map
+        self.dtypes = {} if dtypes is None else dtypes
+        self.transform = transform
+        self.currency = currency
+
+    def read(self, path, **kwargs):
+        return pd.read_csv(path, dtype=self.dtypes, **kwargs)
+
+    def parse(self, data, currency=''):
+        if self.transform is not None:
+            data = self.transform(data)
+        df = pd.DataFrame(
+            {column: self.column_map[column](data, currency) for column in columns},
+            index=data.index,
+            columns=columns,
+        )
+        return df.reset_index(drop=True)
+
+
+def register(parser):
+    parsers[parser.type] = parser
+    return parser
+
+
+def get_parser(type):
+    if type not in parsers:
+        if type in modules:
+            importlib.import_module(modules[type])
+        else:
+            load_entry_point(type)
+    if type not in parsers:
+        raise Exception('Unsupported csv type: {}'.format(type))
+    return parsers[type]
+
+
+def load_entry_point(type):
+    # An entry point named after the csv type which loads to a Parser
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+    found = entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=entry_point_group)
+    else:
+        found = found.get(entry_point_group, [])
+    for entry_point in found:
+        if entry_point.name == type:
+            register(entry_point.load())
+
+
+def read_header(path, size=4096):
+    # Columns in the first line of a csv file, reading only its first bytes
+    with open(path, mode='rb') as f:
+        head = f.read(size)
+    line = head.split(b'\n', 1)[0].decode('utf-8-sig', errors='ignore')
+    return [column.strip() for column in next(csv.reader([line]), [])]
+
+
+def detect(path, coins=()):
+    # csv type and currency of a file from its header, or None.
+    # The parser with the largest schema within the header is chosen. Among parsers with
+    # the same schema, the one with more words of its type in the file name comes first,
+    # then the order of csv_types. For types which need a currency, it is the file name
+    # up to the first '_', as in btc_deposit.csv, if that is one of coins and the name does
+    # not start with the type, as zaif_deposit.csv does; otherwise the currency is None.
+    for module in sorted(set(modules.values())):
+        importlib.import_module(module)
+    try:
+        header = set(read_header(path))
+    except OSError:
+        return None
+    name = os.path.basename(path).lower()
+    order = list(csv_types.values())
+    candidates = [parser for parser in parsers.values() if set(parser.schema) <= header]
+    if len(candidates) == 0:
+        return None
+    best = max(
+        candidates,
+        key=lambda parser: (
+            len(parser.schema),
+            sum(word in name.replace('_', '') for word in parser.type.split('_')),
+            -order.index(parser.type) if parser.type in order else -len(order),
+        ),
+    )
+    currency = ''
+    if best.currency:
+        prefix = name.split('_')[0]
+        currency = prefix if prefix in coins and not name.startswith(best.type) else None
+    return best.type, currency
+
+
+# Column builders for column_map of parsers.
+# Each returns a function of (data, currency) giving a whole column or a scalar.
+def col_rename(name):
+    return lambda data, currency: data[name]
+
+
+def col_const(value):
+    return lambda data, currency: value
+
+
+def col_currency():
+    return lambda data, currency: currency
+
+
+def col_abs(name):
+    return lambda data, currency: data[name].abs()
+
+
+def col_lower(name):
+    return lambda data, currency: data[name].str.lower()
+
+
+def col_map(name, type_map):
+    def rule(data, currency):
+        unknown = ~data[name].isin(list(type_map.keys()))
+        if unknown.any():
+            raise KeyError(data[name][unknown].iloc[0])
+        return data[name].map(type_map)
+    return rule
@@ -0,0 +1,44 @@
+from exchanges import Parser, register, wallets, tx_types, csv_types, col_rename, col_const, col_map
+
+
+def market(data, currency):
+    # BCH was listed as BCC
+    return data['通貨ペア'].str.replace('^bcc_', 'bch_', regex=True)
+
+
+register(Parser(
+    csv_types['BITBANK'],
+    schema=['取引日時', '売/買', '価格', '通貨ペア', '数量', '手数料'],
+    dtypes={'売/買': str, '通貨ペア': str},
+    column_map={
+        'time': col_rename('取引日時'),
+        'type': col_map('売/買', {
+            'sell': tx_types['BID'],
+            'buy': tx_types['ASK'],
+        }),
+        'price': col_rename('価格'),
+        'market': market,
+        'amount': col_rename('数量'),
+        'cost': col_rename('手数料'),
+        'exchange': col_const(wallets['BITBANK']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['BITBANK_DEPOSIT_WITHDRAW'],
+    schema=['日時', '種別', '金額', '通貨', '手数料'],
+    dtypes={'種別': str, '通貨': str},
+    column_map={
+        'time': col_rename('日時'),
+        'type': col_rename('種別'),
+        'amount': col_rename('金額'),
+        'market': col_rename('通貨'),
+        'price': col_const(0),
+        'cost': col_rename('手数料'),
+        'exchange': col_const(wallets['BITBANK']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
@@ -0,0 +1,59 @@
+import pandas as pd
+from exchanges import Parser, register, wallets, csv_types, col_rename, col_const
+
+
+currencies = [
+    'BTC', 'ETH', 'ETC', 'LTC', 'BCH', 'MONA', 'JPY',
+]
+
+
+def split_currency(data):
+    # '通貨' is either a pair like 'BTC/JPY' or a single currency like 'BTC'
+    pair = data['通貨'].str.endswith('/JPY')
+    unknown = ~pair & ~data['通貨'].isin(currencies)
+    if unknown.any():
+        raise Exception('Unsupported currency: {}'.format(data['通貨'][unknown].iloc[0]))
+    return data.assign(coin=data['通貨'].str.split('/').str[0], pair=pair)
+
+
+def market(data, currency):
+    coin = data['coin'].str.lower()
+    return coin.where(~data['pair'], coin + '_jpy')
+
+
+def pick(data, prefix, suffix, optional):
+    # pick the column named after the coin of each row
+    picked = pd.Series(0.0, index=data.index)
+    for coin in data['coin'].unique():
+        name = prefix + coin + suffix
+        if name in data.columns or not optional:
+            mask = data['coin'] == coin
+            picked[mask] = data.loc[mask, name]
+    return picked.abs()
+
+
+def amount(data, currency):
+    return pick(data, '', '', optional=False)
+
+
+def cost(data, currency):
+    return pick(data, '手数料(', ')', optional=True)
+
+
+register(Parser(
+    csv_types['BITFLYER'],
+    schema=['取引日時', '通貨', '取引種別', '価格'],
+    dtypes={'通貨': str, '取引種別': str},
+    transform=split_currency,
+    column_map={
+        'time': col_rename('取引日時'),
+        'type': col_rename('取引種別'),
+        'price': col_rename('価格'),
+        'market': market,
+        'amount': amount,
+        'cost': cost,
+        'exchange': col_const(wallets['BF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
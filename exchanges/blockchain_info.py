@@ -0,0 +1,19 @@
+from exchanges import Parser, register, wallets, tx_types, csv_types, col_rename, col_const
+
+
+register(Parser(
+    csv_types['BCINFO_PURCHASE'],
+    schema=['日時', '数量', '通貨', '価格'],
+    dtypes={'通貨': str},
+    column_map={
+        'time': col_rename('日時'),
+        'amount': col_rename('数量'),
+        'market': col_rename('通貨'),
+        'type': col_const(tx_types['PURCHASE']),
+        'price': col_const(0),
+        'cost': col_rename('価格'),
+        'exchange': col_const(wallets['BLOCKCHAIN.INFO']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
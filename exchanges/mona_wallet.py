@@ -0,0 +1,19 @@
+from exchanges import Parser, register, wallets, csv_types, col_rename, col_const
+
+
+register(Parser(
+    csv_types['MONAWALLET'],
+    schema=['日時', '種別', '金額', '通貨', '手数料'],
+    dtypes={'種別': str, '通貨': str},
+    column_map={
+        'time': col_rename('日時'),
+        'type': col_rename('種別'),
+        'amount': col_rename('金額'),
+        'market': col_rename('通貨'),
+        'price': col_const(0),
+        'cost': col_rename('手数料'),
+        'exchange': col_const(wallets['MONAWALLET']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
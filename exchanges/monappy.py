@@ -0,0 +1,23 @@
+from exchanges import Parser, register, wallets, tx_types, csv_types, col_rename, col_const, col_abs, col_map
+
+
+register(Parser(
+    csv_types['MONAPPY'],
+    schema=['日付', '金額', '種別'],
+    dtypes={'種別': str},
+    column_map={
+        'time': col_rename('日付'),
+        'amount': col_abs('金額'),
+        'market': col_const('mona'),
+        'type': col_map('種別', {
+            '受け取り': tx_types['RECEIVE'],
+            '送金': tx_types['SEND'],
+            '手数料': tx_types['FEE'],
+        }),
+        'price': col_const(0),
+        'cost': col_const(0),
+        'exchange': col_const(wallets['MONAPPY']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
@@ -0,0 +1,19 @@
+from exchanges import Parser, register, wallets, csv_types, col_rename, col_const, col_abs
+
+
+register(Parser(
+    csv_types['TIPMONA'],
+    schema=['日付', '金額', '種別', '手数料'],
+    dtypes={'種別': str},
+    column_map={
+        'time': col_rename('日付'),
+        'amount': col_abs('金額'),
+        'market': col_const('mona'),
+        'type': col_rename('種別'),
+        'price': col_const(0),
+        'cost': col_rename('手数料'),
+        'exchange': col_const(wallets['TIPMONA']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
@@ -0,0 +1,142 @@
+from exchanges import (
+    Parser, register, wallets, tx_types, csv_types,
+    col_rename, col_const, col_currency, col_lower, col_map,
+)
+
+
+register(Parser(
+    csv_types['ZAIF_TRADE'],
+    schema=['日時', '取引種別', '価格', 'マーケット', '数量', '取引手数料'],
+    dtypes={'取引種別': str, 'マーケット': str},
+    column_map={
+        'time': col_rename('日時'),
+        'type': col_map('取引種別', {
+            'bid': tx_types['ASK'],
+            'ask': tx_types['BID'],
+        }),
+        'price': col_rename('価格'),
+        'market': col_rename('マーケット'),
+        'amount': col_rename('数量'),
+        'cost': col_rename('取引手数料'),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['ZAIF_DEPOSIT'],
+    currency=True,
+    schema=['日時', '金額'],
+    column_map={
+        'time': col_rename('日時'),
+        'amount': col_rename('金額'),
+        'market': col_currency(),
+        'type': col_const(tx_types['DEPOSIT']),
+        'price': col_const(0),
+        'cost': col_const(0),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['ZAIF_ERC20_DEPOSIT'],
+    schema=['日時', '金額', 'トークン'],
+    dtypes={'トークン': str},
+    column_map={
+        'time': col_rename('日時'),
+        'amount': col_rename('金額'),
+        'market': col_lower('トークン'),
+        'type': col_const(tx_types['DEPOSIT']),
+        'price': col_const(0),
+        'cost': col_const(0),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['ZAIF_PURCHASE'],
+    schema=['日時', '数量', '通貨', '価格'],
+    dtypes={'通貨': str},
+    column_map={
+        'time': col_rename('日時'),
+        'amount': col_rename('数量'),
+        'market': col_rename('通貨'),
+        'type': col_const(tx_types['PURCHASE']),
+        'price': col_const(0),
+        'cost': col_rename('価格'),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['ZAIF_BONUS'],
+    schema=['支払日時', '支払ボーナス'],
+    column_map={
+        'time': col_rename('支払日時'),
+        'amount': col_rename('支払ボーナス'),
+        'market': col_const('jpy'),
+        'type': col_const(tx_types['RECEIVE']),
+        'price': col_const(0),
+        'cost': col_const(0),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['ZAIF_CREDIT_TRADE'],
+    schema=['決済完了日時', '損益（円）'],
+    column_map={
+        'time': col_rename('決済完了日時'),
+        'amount': col_rename('損益（円）'),
+        'market': col_const('jpy'),
+        'type': col_const(tx_types['RECEIVE']),
+        'price': col_const(0),
+        'cost': col_const(0),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['ZAIF_WITHDRAW'],
+    currency=True,
+    schema=['日時', '金額', '手数料'],
+    column_map={
+        'time': col_rename('日時'),
+        'amount': col_rename('金額'),
+        'market': col_currency(),
+        'type': col_const(tx_types['WITHDRAW']),
+        'price': col_const(0),
+        'cost': col_rename('手数料'),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
+
+register(Parser(
+    csv_types['ICO'],
+    schema=['日時', '数量', 'マーケット', '金額'],
+    dtypes={'マーケット': str},
+    column_map={
+        'time': col_rename('日時'),
+        'amount': col_rename('数量'),
+        'market': col_rename('マーケット'),
+        'type': col_const(tx_types['ICO']),
+        'price': col_rename('金額'),
+        'cost': col_const(0),
+        'exchange': col_const(wallets['ZAIF']),
+        'profit': col_const(0),
+        'total_profit': col_const(0),
+    },
+))
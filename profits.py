@@ -1,66 +1,47 @@
-import traceback
 import sys
 import os
 import math
 import json
+import numpy as np
 import pandas as pd
 from datetime import timedelta
 import requests
 import pickle
-
-
-# global settings
-wallets = {
-    'ZAIF': 'zaif',
-    'BF': 'bitflyer',
-    'BITBANK': 'bitbank',
-    'BLOCKCHAIN.INFO': 'blockchain.info',
-    'TIPMONA': 'tipmona',
-    'MONAPPY': 'monappy',
-    'MONAWALLET': 'mona_wallet',
-}
-tx_types = {
-    'BID': '売り',
-    'ASK': '買い',
-    'RECEIVE': '受取',
-    'WITHDRAW': '出金',
-    'DEPOSIT': '預入',
-    'FEE': '手数料',
-    'SEND': '外部送付',
-    'PURCHASE': '購入',
-    'SELF': '自己',
-    'ICO': 'ICO',
-}
-csv_types = {
-    'ZAIF_TRADE': 'zaif_trade',
-    'ZAIF_CREDIT_TRADE': 'zaif_credit_trade',
-    'ZAIF_DEPOSIT': 'zaif_deposit',
-    'ZAIF_ERC20_DEPOSIT': 'zaif_erc20_deposit',
-    'ZAIF_WITHDRAW': 'zaif_withdraw',
-    'ZAIF_PURCHASE': 'zaif_purchase',
-    'ZAIF_BONUS': 'zaif_bonus',
-    'BCINFO_PURCHASE': 'bcinfo_purchase',
-    'BITFLYER': 'bitflyer',
-    'BITBANK': 'bitbank',
-    'BITBANK_DEPOSIT_WITHDRAW': 'bitbank_deposit_withdraw',
-    'MONAPPY': 'monappy',
-    'MONAWALLET': 'monawallet',
-    'TIPMONA': 'tipmona',
-    'ICO': 'ico',
-}
+import glob
+import hashlib
+import itertools
+import collections
+import contextlib
+import io
+import heapq
+import tempfile
+import sqlite3
+import threading
+import time as clock
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import exchanges
+from exchanges import wallets, tx_types, csv_types, get_parser
 
 
 class TradeHistory:
-    columns = [
-        'market', 'type', 'price', 'cost', 'amount', 'time',
-        'exchange', 'profit', 'total_profit',
-    ]
-    bf_currencies = [
-        'BTC', 'ETH', 'ETC', 'LTC', 'BCH', 'MONA', 'JPY',
-    ]
+    columns = exchanges.columns
+    dtypes = {
+        'market': 'category',
+        'type': 'category',
+        'price': 'float64',
+        'cost': 'float64',
+        'amount': 'float64',
+        'time': 'datetime64[ns, UTC]',
+        'exchange': 'category',
+        'profit': 'float64',
+        'total_profit': 'float64',
+    }
+    # Format of the columnar storage written by save
+    storage_version = 1
 
     def __init__(self):
-        self.data = pd.DataFrame(columns=TradeHistory.columns)
+        self.data = pd.DataFrame(columns=TradeHistory.columns).astype(TradeHistory.dtypes)
 
     def __getattr__(self, name):
         # wrapping pandas dataframe
@@ -73,245 +54,791 @@ class TradeHistory:
         return self.data.tail(rows)
 
     def set_data(self, data, type):
-        self.data = self.format_data(data, type)
+        self.data = TradeHistory().data
+        self.append_data(data, type)
 
     def append_data(self, data, type, currency=''):
-        self.data = self.data.append(self.format_data(data, type, currency))
+        self.concat_data([self.format_data(data, type, currency)])
+
+    @staticmethod
+    def typed(data):
+        data = data.assign(time=pd.to_datetime(data['time'], utc=True))
+        return data.astype(TradeHistory.dtypes)
+
+    def concat_data(self, frames):
+        # Concatenate all frames at once rather than copying the accumulated data per frame
+        frames = [TradeHistory.typed(frame) for frame in [self.data] + list(frames) if len(frame) > 0]
+        if len(frames) == 0:
+            return
+        data = pd.concat(frames, ignore_index=True).astype(TradeHistory.dtypes)
+        # mergesort keeps the order of transactions at the same time
+        self.data = data.sort_values(by='time', kind='mergesort').reset_index(drop=True)
+
+    def save(self, path):
+        # Columnar storage: a .npy file per column and meta.json, in the directory of path.
+        # market/type/exchange are stored as codes of their categories.
+        os.makedirs(path, exist_ok=True)
+        meta = {'version': TradeHistory.storage_version, 'rows': len(self.data), 'categories': {}}
+        for column in TradeHistory.columns:
+            values = self.data[column]
+            if TradeHistory.dtypes[column] == 'category':
+                meta['categories'][column] = [str(c) for c in values.cat.categories]
+                values = values.cat.codes
+            elif column == 'time':
+                values = values.dt.tz_convert(None)
+            np.save(os.path.join(path, column + '.npy'), values.to_numpy())
+        with open(os.path.join(path, 'meta.json'), mode='w') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def load(self, path):
+        # Columns are memory-mapped instead of read into memory
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != TradeHistory.storage_version:
+            raise Exception('Unsupported storage version: {}'.format(meta['version']))
+        data = {}
+        for column in TradeHistory.columns:
+            values = np.load(os.path.join(path, column + '.npy'), mmap_mode='r')
+            if column in meta['categories']:
+                values = pd.Categorical.from_codes(values, meta['categories'][column])
+            elif column == 'time':
+                values = pd.Series(values, copy=False).dt.tz_localize('UTC')
+            data[column] = values
+        self.data = pd.DataFrame(data, columns=TradeHistory.columns, copy=False)
+
+    @staticmethod
+    def iter_rows(path, block=4096):
+        # Rows of a ledger written by save, as dicts, reading block rows at a time
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {c: np.load(os.path.join(path, c + '.npy'), mmap_mode='r') for c in TradeHistory.columns}
+        for start in range(0, meta['rows'], block):
+            columns = []
+            for column in TradeHistory.columns:
+                part = arrays[column][start:start + block]
+                if column in meta['categories']:
+                    categories = meta['categories'][column]
+                    columns.append([categories[code] for code in part.tolist()])
+                elif column == 'time':
+                    columns.append(pd.DatetimeIndex(part).tz_localize('UTC').tolist())
+                else:
+                    columns.append(part.tolist())
+            for values in zip(*columns):
+                yield dict(zip(TradeHistory.columns, values))
+
+    def hashes(self):
+        # Hash of every transaction, regardless of its profit
+        columns = [c for c in TradeHistory.columns if c not in ['profit', 'total_profit']]
+        return pd.util.hash_pandas_object(self.data[columns], index=False).to_numpy()
 
     def format_data(self, data, type, currency=''):
-        # for row-wise process
-        if type == csv_types['BITFLYER']:
-            def rule(row, currency):
-                if row['通貨'].endswith('/JPY'):
-                    coin = row['通貨'].split('/')[0]
-                    market = coin.lower() + '_jpy'
-                elif row['通貨'] in TradeHistory.bf_currencies:
-                    coin = row['通貨']
-                    market = coin.lower()
-                return {
-                    'time': row['取引日時'],
-                    'type': row['取引種別'],
-                    'price': row['価格'],
-                    'market': market,
-                    'amount': abs(row[coin]),
-                    'cost': abs(row.get('手数料(' + coin + ')', 0)),
-                    'exchange': wallets['BF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['BITBANK']:
-            def rule(row, currency):
-                type_map = {
-                    'sell': tx_types['BID'],
-                    'buy': tx_types['ASK'],
-                }
-
-                def market_map(market):
-                    if market == 'bcc_btc':
-                        return 'bch_btc'
-                    elif market == 'bcc_jpy':
-                        return 'bch_jpy'
-                    else:
-                        return market
-                return {
-                    'time': row['取引日時'],
-                    'type': type_map[row['売/買']],
-                    'price': row['価格'],
-                    'market': market_map(row['通貨ペア']),
-                    'amount': row['数量'],
-                    'cost': row['手数料'],
-                    'exchange': wallets['BITBANK'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['BITBANK_DEPOSIT_WITHDRAW']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'type': row['種別'],
-                    'amount': row['金額'],
-                    'market': row['通貨'],
-                    'price': 0,
-                    'cost': row['手数料'],
-                    'exchange': wallets['BITBANK'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ZAIF_TRADE']:
-            type_map = {
-                'bid': tx_types['ASK'],
-                'ask': tx_types['BID'],
-            }
-
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'type': type_map[row['取引種別']],
-                    'price': row['価格'],
-                    'market': row['マーケット'],
-                    'amount': row['数量'],
-                    'cost': row['取引手数料'],
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ZAIF_DEPOSIT']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'amount': row['金額'],
-                    'market': currency,
-                    'type': tx_types['DEPOSIT'],
-                    'price': 0,
-                    'cost': 0,
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ZAIF_ERC20_DEPOSIT']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'amount': row['金額'],
-                    'market': row['トークン'].lower(),
-                    'type': tx_types['DEPOSIT'],
-                    'price': 0,
-                    'cost': 0,
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ZAIF_PURCHASE']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'amount': row['数量'],
-                    'market': row['通貨'],
-                    'type': tx_types['PURCHASE'],
-                    'price': 0,
-                    'cost': row['価格'],
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['BCINFO_PURCHASE']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'amount': row['数量'],
-                    'market': row['通貨'],
-                    'type': tx_types['PURCHASE'],
-                    'price': 0,
-                    'cost': row['価格'],
-                    'exchange': wallets['BLOCKCHAIN.INFO'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ZAIF_BONUS']:
-            def rule(row, currency):
-                return {
-                    'time': row['支払日時'],
-                    'amount': row['支払ボーナス'],
-                    'market': 'jpy',
-                    'type': tx_types['RECEIVE'],
-                    'price': 0,
-                    'cost': 0,
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ZAIF_CREDIT_TRADE']:
-            def rule(row, currency):
-                return {
-                    'time': row['決済完了日時'],
-                    'amount': row['損益（円）'],
-                    'market': 'jpy',
-                    'type': tx_types['RECEIVE'],
-                    'price': 0,
-                    'cost': 0,
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ZAIF_WITHDRAW']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'amount': row['金額'],
-                    'market': currency,
-                    'type': tx_types['WITHDRAW'],
-                    'price': 0,
-                    'cost': row['手数料'],
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['MONAPPY']:
-            type_map = {
-                '受け取り': tx_types['RECEIVE'],
-                '送金': tx_types['SEND'],
-                '手数料': tx_types['FEE'],
-            }
-
-            def rule(row, currency):
-                return {
-                    'time': row['日付'],
-                    'amount': abs(row['金額']),
-                    'market': 'mona',
-                    'type': type_map[row['種別']],
-                    'price': 0,
-                    'cost': 0,
-                    'exchange': wallets['MONAPPY'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['TIPMONA']:
-            def rule(row, currency):
-                return {
-                    'time': row['日付'],
-                    'amount': abs(row['金額']),
-                    'market': 'mona',
-                    'type': row['種別'],
-                    'price': 0,
-                    'cost': row['手数料'],
-                    'exchange': wallets['TIPMONA'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['MONAWALLET']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'type': row['種別'],
-                    'amount': row['金額'],
-                    'market': row['通貨'],
-                    'price': 0,
-                    'cost': row['手数料'],
-                    'exchange': wallets['MONAWALLET'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        elif type == csv_types['ICO']:
-            def rule(row, currency):
-                return {
-                    'time': row['日時'],
-                    'amount': row['数量'],
-                    'market': row['マーケット'],
-                    'type': tx_types['ICO'],
-                    'price': row['金額'],
-                    'cost': 0,
-                    'exchange': wallets['ZAIF'],
-                    'profit': 0,
-                    'total_profit': 0,
-                }
-        df = pd.DataFrame(
-            [rule(row, currency) for index, row in data.iterrows()],
-            columns=TradeHistory.columns
+        # column-wise process by the parser of the csv type
+        return get_parser(type).parse(data, currency)
+
+
+def list_sources(data_list):
+    # (csv type, path, currency) of the existing files in data_list
+    return [
+        (key, item['path'], item.get('currency', ''))
+        for key, value in data_list.items()
+        for item in value
+        if os.path.exists(item['path'])
+    ]
+
+
+def read_history(source):
+    # Read and format one (csv type, path, currency); also run in worker processes
+    type, path, currency = source
+    return TradeHistory.typed(TradeHistory().format_data(get_parser(type).read(path), type, currency))
+
+
+def read_cached(job):
+    # Read one source through the ingestion cache; also run in worker processes.
+    # Returns the frame and the new manifest entry of the source.
+    source, directory, entry = job
+    type, path, currency = source
+    stat = os.stat(path)
+    frame_path = os.path.join(directory, IngestCache.key(source) + '.pickle')
+    cached = entry is not None and entry['version'] == IngestCache.version and os.path.exists(frame_path)
+    if cached and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return pd.read_pickle(frame_path), entry
+    with open(path, mode='rb') as f:
+        content = f.read()
+    if cached and len(content) > entry['size'] and hashlib.sha1(content[:entry['size']]).hexdigest() == entry['sha1']:
+        # rows were only appended; parse the header and the new rows
+        header = content[:content.index(b'\n') + 1]
+        tail = get_parser(type).read(io.BytesIO(header + content[entry['size']:]))
+        frame = pd.concat(
+            [pd.read_pickle(frame_path), TradeHistory().format_data(tail, type, currency)],
+            ignore_index=True,
         )
-        return df
+        frame = TradeHistory.typed(frame)
+    else:
+        frame = TradeHistory.typed(TradeHistory().format_data(get_parser(type).read(io.BytesIO(content)), type, currency))
+    frame.to_pickle(frame_path)
+    entry = {
+        'version': IngestCache.version,
+        'type': type,
+        'path': path,
+        'currency': currency,
+        'size': len(content),
+        'mtime': stat.st_mtime_ns,
+        'sha1': hashlib.sha1(content).hexdigest(),
+        'rows': len(frame),
+    }
+    return frame, entry
+
+
+def stream_history(data_list, chunksize=100000, directory=None, prepare=None):
+    # Rows of all sources in time order with memory bounded by chunksize.
+    # Every chunk is sorted and spilled to directory (a temporary one by default),
+    # then the chunks are merged by a heap, reading a block of rows from each at a time
+    # so that about chunksize rows are held in total.
+    # prepare, e.g. ProfitCalculator.prepare, is called with every chunk before the first row.
+    with tempfile.TemporaryDirectory(dir=directory) as spill:
+        paths = []
+        for key, value in data_list.items():
+            for item in value:
+                if not os.path.exists(item['path']):
+                    continue
+                for chunk in get_parser(key).read(item['path'], chunksize=chunksize):
+                    trade = TradeHistory()
+                    trade.data = TradeHistory.typed(trade.format_data(chunk, key, item.get('currency', '')))
+                    trade.data = trade.data.sort_values(by='time', kind='mergesort').reset_index(drop=True)
+                    if prepare is not None:
+                        prepare(trade.data)
+                    path = os.path.join(spill, str(len(paths)))
+                    trade.save(path)
+                    paths.append(path)
+        block = max(64, chunksize // max(1, len(paths)))
+        runs = [TradeHistory.iter_rows(path, block) for path in paths]
+        # heapq.merge keeps the order of runs for rows at the same time, like load_history
+        yield from heapq.merge(*runs, key=lambda row: row['time'])
+
+
+class IngestCache:
+    # Manifest of parsed csv files with their formatted frames, so that unchanged
+    # files are not parsed again and appended files are parsed only for new rows
+    version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def key(source):
+        type, path, currency = source
+        name = json.dumps([type, os.path.abspath(path), currency])
+        return hashlib.sha1(name.encode()).hexdigest()[:16]
+
+    def jobs(self, sources):
+        return [(source, self.directory, self.manifest.get(IngestCache.key(source))) for source in sources]
+
+    def update(self, sources, entries):
+        for source, entry in zip(sources, entries):
+            self.manifest[IngestCache.key(source)] = entry
+        with open(self.path + '.tmp', mode='w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class PriceStore:
+    # Fair values in JPY keyed by symbol, exchange and minute, persisted in SQLite.
+    # A readonly store can be shared by many processes.
+    def __init__(self, path='prices.sqlite3', readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.connection = None
+        self.memory = {}
+
+    def connect(self):
+        # the file is created on first use
+        if self.connection is None:
+            if self.readonly:
+                self.connection = sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True)
+                return self.connection
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS prices ('
+                'symbol TEXT, exchange TEXT, minute INTEGER, price REAL, '
+                'PRIMARY KEY (symbol, exchange, minute))'
+            )
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get(self, symbol, exchange, minute):
+        key = (symbol, exchange, minute)
+        if key not in self.memory:
+            row = self.connect().execute(
+                'SELECT price FROM prices WHERE symbol = ? AND exchange = ? AND minute = ?', key
+            ).fetchone()
+            if row is None:
+                return None
+            self.memory[key] = row[0]
+        return self.memory[key]
+
+    def put(self, symbol, exchange, minute, price):
+        self.put_many(symbol, exchange, {minute: price})
+
+    def put_many(self, symbol, exchange, prices):
+        # prices is a dict of minute (unix time) to price
+        if self.readonly:
+            raise Exception('Price store {} is read only'.format(self.path))
+        rows = [(symbol, exchange, int(minute), float(price)) for minute, price in prices.items()]
+        with self.connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?)', rows)
+        for _, _, minute, price in rows:
+            self.memory[(symbol, exchange, minute)] = price
+
+
+class LocalPrices:
+    # Fair values from local dumps of 1-minute OHLC data, for hosts without network.
+    # Used in place of PriceStore; lookups are binary searches in sorted arrays per symbol.
+    #   fallback: seconds to go back for the nearest earlier candle when the minute
+    #       has none; 0 for exact minutes only, None for no limit
+    #   offset: seconds added to the times of dumps; transaction times are JST wall clock
+    #       read as UTC, while dumps are in unix time
+    def __init__(self, fallback=0, offset=9 * 3600):
+        self.fallback = fallback
+        self.offset = offset
+        self.pending = {}
+        self.charts = {}
+
+    def load(self, path, symbol=None, exchange=None):
+        # csv or parquet with 'time' (unix seconds or milliseconds, or datetime strings in UTC)
+        # and 'close'; 'symbol' and 'exchange' columns may be given instead of the arguments
+        if path.endswith('.parquet'):
+            data = pd.read_parquet(path)
+        else:
+            data = pd.read_csv(path)
+        if pd.api.types.is_numeric_dtype(data['time']):
+            seconds = data['time'].to_numpy(dtype='int64')
+            if len(seconds) > 0 and seconds.max() > 10 ** 11:
+                seconds = seconds // 1000
+        else:
+            seconds = (pd.to_datetime(data['time'], utc=True) - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+            seconds = seconds.to_numpy(dtype='int64')
+        data = pd.DataFrame({
+            'symbol': data['symbol'] if 'symbol' in data.columns else symbol,
+            'exchange': data['exchange'] if 'exchange' in data.columns else exchange,
+            'minute': seconds // 60 * 60 + self.offset,
+            'close': data['close'].to_numpy(dtype=float),
+        })
+        for (symbol, exchange), group in data.groupby(['symbol', 'exchange'], dropna=False, sort=False):
+            exchange = None if pd.isna(exchange) else exchange
+            self.add(symbol, exchange, group['minute'].to_numpy(), group['close'].to_numpy())
+
+    def add(self, symbol, exchange, minutes, closes):
+        self.pending.setdefault((symbol, exchange), []).append((np.asarray(minutes, dtype='int64'), np.asarray(closes, dtype=float)))
+
+    def chart(self, symbol, exchange):
+        # (minutes, closes) sorted by minute; later loads win for the same minute
+        key = (symbol, exchange)
+        if key in self.pending:
+            parts = self.pending.pop(key)
+            if key in self.charts:
+                parts.insert(0, self.charts[key])
+            minutes = np.concatenate([m for m, _ in parts])
+            closes = np.concatenate([c for _, c in parts])
+            order = np.argsort(minutes, kind='mergesort')
+            minutes, closes = minutes[order], closes[order]
+            last = np.append(minutes[1:] != minutes[:-1], True)
+            self.charts[key] = (minutes[last], closes[last])
+        return self.charts.get(key)
+
+    def get(self, symbol, exchange, minute):
+        for key in [(symbol, exchange), (symbol, None)]:
+            chart = self.chart(*key)
+            if chart is None:
+                continue
+            minutes, closes = chart
+            i = int(np.searchsorted(minutes, minute, side='right')) - 1
+            if i >= 0 and (minutes[i] == minute or self.fallback is None or minute - minutes[i] <= self.fallback):
+                return float(closes[i])
+        return None
+
+    def put(self, symbol, exchange, minute, price):
+        self.put_many(symbol, exchange, {minute: price})
+
+    def put_many(self, symbol, exchange, prices):
+        self.add(symbol, exchange, list(prices.keys()), list(prices.values()))
+
+    def close(self):
+        pass
+
+
+class PriceFetcher:
+    # HTTP client of chart APIs with pooled connections, bounded concurrency,
+    # a rate limit per host and retries with exponential backoff
+    def __init__(self, concurrency=4, rate=5.0, retries=5, backoff=0.5, timeout=30):
+        self.concurrency = concurrency
+        # requests per second to each host; None for no limit
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if not self.rate:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = clock.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + 1.0 / self.rate
+        clock.sleep(slot - now)
+
+    def get(self, url, params=None):
+        for attempt in range(self.retries + 1):
+            self.wait(url)
+            last = attempt == self.retries
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    raise
+                clock.sleep(self.backoff * 2 ** attempt)
+                continue
+            if last or (response.status_code != 429 and response.status_code < 500):
+                return response
+            delay = self.backoff * 2 ** attempt
+            if response.headers.get('Retry-After', '').isdigit():
+                delay = max(delay, int(response.headers['Retry-After']))
+            clock.sleep(delay)
+
+    def map(self, function, items):
+        # results are in the order of items
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(function, items))
+
+
+class Metrics:
+    # Timers, counters and latency histograms of a run, safe to update from threads.
+    # Callbacks subscribed by subscribe are called with (kind, name, value) for every
+    # update, where kind is 'timer', 'count' or 'latency'.
+    # upper bounds of the latency buckets in seconds; the last bucket has no bound
+    buckets = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+
+    def notify(self, kind, name, value):
+        for callback in self.callbacks:
+            callback(kind, name, value)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        self.notify('count', name, n)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {
+                'count': 0, 'seconds': 0.0, 'max': 0.0, 'buckets': [0] * (len(Metrics.buckets) + 1),
+            })
+            histogram['count'] += 1
+            histogram['seconds'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+            histogram['buckets'][int(np.searchsorted(Metrics.buckets, seconds))] += 1
+        self.notify('latency', name, seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        begin = clock.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = clock.perf_counter() - begin
+            with self.lock:
+                timer = self.timers.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                timer['calls'] += 1
+                timer['seconds'] += elapsed
+            self.notify('timer', name, elapsed)
+
+    def summary(self):
+        with self.lock:
+            return json.loads(json.dumps({
+                'timers': self.timers,
+                'counters': self.counters,
+                'histograms': self.histograms,
+            }))
+
+    def print_summary(self, file=None):
+        summary = self.summary()
+        print('-- Timers ---------------------------------', file=file)
+        for name, timer in summary['timers'].items():
+            print('{:<20} {:>10.3f} s {:>10} calls'.format(name, timer['seconds'], timer['calls']), file=file)
+        print('-- Counters -------------------------------', file=file)
+        for name, value in sorted(summary['counters'].items()):
+            print('{:<30} {:>10}'.format(name, value), file=file)
+        for name, histogram in summary['histograms'].items():
+            print('-- Latency of {} ----------------------'.format(name), file=file)
+            print('count: {count}, mean: {mean:.3f} s, max: {max:.3f} s'.format(
+                mean=histogram['seconds'] / histogram['count'], **histogram), file=file)
+            bounds = ['<= {} s'.format(bound) for bound in Metrics.buckets] + ['> {} s'.format(Metrics.buckets[-1])]
+            for bound, count in zip(bounds, histogram['buckets']):
+                if count > 0:
+                    print('{:>10} {:>10}'.format(bound, count), file=file)
+
+
+class Ledger:
+    # Amount of every coin in every wallet as a (coin, wallet) matrix.
+    # Coins and wallets are interned to row and column ids, and ones not seen before get
+    # a new row or column when they are changed. Totals per coin are kept up to date on every change.
+    # ledger[coin][wallet] reads and writes like the former dict of dicts.
+    def __init__(self, coins=(), wallets=()):
+        self.coin_index = {}
+        self.wallet_index = {}
+        self.amounts = np.zeros((0, 0))
+        self.totals = np.zeros(0)
+        self.intern(coins, wallets)
+
+    def intern(self, coins=(), wallets=()):
+        # Add rows and columns for the new coins and wallets at once
+        for coin in coins:
+            self.coin_index.setdefault(coin, len(self.coin_index))
+        for wallet in wallets:
+            self.wallet_index.setdefault(wallet, len(self.wallet_index))
+        rows, columns = self.amounts.shape
+        if len(self.coin_index) > rows or len(self.wallet_index) > columns:
+            self.amounts = np.pad(self.amounts, ((0, len(self.coin_index) - rows), (0, len(self.wallet_index) - columns)))
+            self.totals = np.pad(self.totals, (0, len(self.coin_index) - rows))
+
+    def ids(self, coin, wallet):
+        i = self.coin_index.get(coin)
+        j = self.wallet_index.get(wallet)
+        if i is None or j is None:
+            self.intern([coin], [wallet])
+            i, j = self.coin_index[coin], self.wallet_index[wallet]
+        return i, j
+
+    def get(self, coin, wallet):
+        if coin not in self.coin_index or wallet not in self.wallet_index:
+            return 0.0
+        return float(self.amounts[self.coin_index[coin], self.wallet_index[wallet]])
+
+    def set(self, coin, wallet, amount):
+        i, j = self.ids(coin, wallet)
+        self.totals[i] += amount - self.amounts[i, j]
+        self.amounts[i, j] = amount
+
+    def add(self, coin, wallet, amount):
+        i, j = self.ids(coin, wallet)
+        self.amounts[i, j] += amount
+        self.totals[i] += amount
+
+    def total(self, coin):
+        if coin not in self.coin_index:
+            return 0.0
+        return float(self.totals[self.coin_index[coin]])
+
+    def __getitem__(self, coin):
+        # rows of coins not seen yet are empty
+        return LedgerRow(self, coin)
+
+    def __iter__(self):
+        return iter(self.coin_index)
+
+    def __contains__(self, coin):
+        return coin in self.coin_index
+
+    def keys(self):
+        return self.coin_index.keys()
+
+    def values(self):
+        return [self[coin] for coin in self.coin_index]
+
+    def items(self):
+        return [(coin, self[coin]) for coin in self.coin_index]
+
+
+class LedgerRow:
+    # wallet -> amount view of a coin in a Ledger
+    def __init__(self, ledger, coin):
+        self.ledger = ledger
+        self.coin = coin
+
+    def __getitem__(self, wallet):
+        return self.ledger.get(self.coin, wallet)
+
+    def __setitem__(self, wallet, amount):
+        self.ledger.set(self.coin, wallet, amount)
+
+    def __iter__(self):
+        return iter(self.ledger.wallet_index)
+
+    def keys(self):
+        return self.ledger.wallet_index.keys()
+
+    def values(self):
+        if self.coin not in self.ledger.coin_index:
+            return [0.0] * len(self.ledger.wallet_index)
+        return self.ledger.amounts[self.ledger.coin_index[self.coin]].tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+
+class Lots:
+    # FIFO queue of lots (amount, price, time) in a ring buffer of lists which doubles when full.
+    # Consuming part of the oldest lot only reduces its amount, so every lot is pushed and
+    # popped once and memory is bounded by the lots held at a time.
+    def __init__(self, capacity=16):
+        self.amounts = [0.0] * capacity
+        self.prices = [0.0] * capacity
+        self.times = [0] * capacity
+        self.head = 0
+        self.size = 0
+        # amount and cost in JPY of all lots
+        self.amount = 0.0
+        self.cost = 0.0
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        # only when full, so the lots are the whole buffer from head
+        for name in ['amounts', 'prices', 'times']:
+            values = getattr(self, name)
+            setattr(self, name, values[self.head:] + values[:self.head] + [values[0]] * len(values))
+        self.head = 0
+
+    def push(self, amount, price, time):
+        if round(amount, 8) <= 0:
+            return
+        if self.size == len(self.amounts):
+            self.grow()
+        i = (self.head + self.size) % len(self.amounts)
+        self.amounts[i] = amount
+        self.prices[i] = price
+        self.times[i] = time
+        self.size += 1
+        self.amount += amount
+        self.cost += amount * price
+
+    def consume(self, amount):
+        # (time, amount, price) of the lots consumed, oldest first; less than amount if lots run out
+        consumed = []
+        while round(amount, 8) > 0 and self.size > 0:
+            i = self.head
+            lot = self.amounts[i]
+            used = min(lot, amount)
+            price = self.prices[i]
+            consumed.append((self.times[i], used, price))
+            amount -= used
+            self.amount -= used
+            self.cost -= used * price
+            if round(lot - used, 8) <= 0:
+                self.head = (self.head + 1) % len(self.amounts)
+                self.size -= 1
+            else:
+                self.amounts[i] = lot - used
+        if self.size == 0:
+            self.amount = self.cost = 0.0
+        return consumed
+
+    def clear(self):
+        self.head = self.size = 0
+        self.amount = self.cost = 0.0
+
+
+class LotIndex:
+    # Lots of every (coin, wallet). Withdrawn coins keep their lots in transit until a
+    # deposit of the coin takes them, so lots follow coins moved between wallets.
+    def __init__(self):
+        # coin -> {wallet: Lots}
+        self.lots = {}
+
+    def get(self, coin, wallet):
+        # wallet None is the coins in transit
+        lots = self.lots.setdefault(coin, {})
+        if wallet not in lots:
+            lots[wallet] = Lots()
+        return lots[wallet]
+
+    def acquire(self, coin, wallet, amount, price, time):
+        self.get(coin, wallet).push(amount, price, time)
+
+    def dispose(self, coin, wallet, amount):
+        return self.get(coin, wallet).consume(amount)
+
+    def withdraw(self, coin, wallet, amount):
+        transit = self.get(coin, None)
+        for time, used, price in self.get(coin, wallet).consume(amount):
+            transit.push(used, price, time)
+
+    def deposit(self, coin, wallet, amount, price, time):
+        # Coins in transit come first; the rest is new lots at price
+        lots = self.get(coin, wallet)
+        consumed = self.get(coin, None).consume(amount)
+        for lot_time, used, lot_price in consumed:
+            lots.push(used, lot_price, lot_time)
+        lots.push(amount - sum(used for _, used, _ in consumed), price, time)
+
+    def clear(self, coin):
+        for lots in self.lots.get(coin, {}).values():
+            lots.clear()
+
+    def average(self, coin):
+        # Cost per coin of the lots held in wallets, or None without any
+        amount = cost = 0.0
+        for wallet, lots in self.lots.get(coin, {}).items():
+            if wallet is not None:
+                amount += lots.amount
+                cost += lots.cost
+        return cost / amount if round(amount, 8) > 0 else None
+
+
+class CostBasis:
+    # Method of acquisition costs. The calculator calls
+    #   acquire when coins are acquired, after they are in the ledger and their lot is added;
+    #   total is the amount held before
+    #   dispose when coins are sold, with the lots the sale took if lots are tracked,
+    #   for the cost per coin charged to the profit
+    #   update when lots of a coin are taken or moved otherwise
+    #   new_year before the first transaction of every year and settle at the end of a calculation
+    # and keeps the current cost per coin of every coin in acq_costs.
+    name = None
+    # whether the method needs the lots of the calculator; see LotIndex
+    uses_lots = False
+
+    def __init__(self):
+        self.year = None
+
+    def acquire(self, cal, coin, amount, price, total, jpy=None):
+        raise NotImplementedError
+
+    def dispose(self, cal, coin, amount, lots=()):
+        raise NotImplementedError
+
+    def update(self, cal, coin):
+        pass
+
+    def new_year(self, cal, year):
+        self.year = year
+
+    def settle(self, cal):
+        pass
+
+
+class MovingAverage(CostBasis):
+    # 移動平均法: the cost is the average over the holdings, updated at every acquisition
+    name = 'moving_average'
+
+    def acquire(self, cal, coin, amount, price, total, jpy=None):
+        if cal.has_coin(total):
+            # if this was the first time to have this type of coin
+            cal.acq_costs[coin] = price if jpy is None else jpy / cal.coins.total(coin)
+        else:
+            former_cost = cal.acq_costs[coin] * total
+            cost = former_cost + (price * amount if jpy is None else jpy)
+            cal.acq_costs[coin] = cost / cal.coins.total(coin)
+
+    def dispose(self, cal, coin, amount, lots=()):
+        return cal.ceil(cal.acq_costs[coin])
+
+
+class TotalAverage(CostBasis):
+    # 総平均法: the cost of a year is the average over the holdings at its start and all
+    # acquisitions in it. Sales are charged the average so far, and the profit of the
+    # year is corrected by settle when the year is over, so profits of rows are provisional.
+    name = 'total_average'
+
+    def __init__(self):
+        super().__init__()
+        # coin -> [amount, jpy] held at the start of the year, acquired in it and sold in it
+        self.opening = {}
+        self.acquired = {}
+        self.sold = {}
+
+    def average(self, cal, coin):
+        amount, jpy = self.opening.get(coin, (0, 0))
+        acquired = self.acquired.get(coin, (0, 0))
+        amount, jpy = amount + acquired[0], jpy + acquired[1]
+        if amount <= 0:
+            return cal.acq_costs[coin]
+        return jpy / amount
+
+    def acquire(self, cal, coin, amount, price, total, jpy=None):
+        acquired = self.acquired.setdefault(coin, [0, 0])
+        acquired[0] += amount
+        acquired[1] += price * amount if jpy is None else jpy
+        cal.acq_costs[coin] = self.average(cal, coin)
+
+    def dispose(self, cal, coin, amount, lots=()):
+        cost = cal.ceil(self.average(cal, coin))
+        sold = self.sold.setdefault(coin, [0, 0])
+        sold[0] += amount
+        sold[1] += cost * amount
+        return cost
+
+    def settle(self, cal):
+        # Charge the sales of the year with the average of the year
+        for coin, sold in self.sold.items():
+            cost = cal.ceil(self.average(cal, coin)) * sold[0]
+            cal.profit[self.year] += sold[1] - cost
+            sold[1] = cost
+
+    def new_year(self, cal, year):
+        if self.year is not None:
+            self.settle(cal)
+            opening = {}
+            for coin in cal.acq_costs:
+                cal.acq_costs[coin] = self.average(cal, coin)
+                amount = max(cal.coins.total(coin), 0)
+                opening[coin] = (amount, amount * cal.acq_costs[coin])
+            self.opening, self.acquired, self.sold = opening, {}, {}
+        self.year = year
+
+
+class Fifo(CostBasis):
+    # 先入先出法: sales are charged the lots they take from the LotIndex of the calculator,
+    # the oldest first in the wallet of the sale; acq_costs shows the average of the lots held
+    name = 'fifo'
+    uses_lots = True
+
+    def update(self, cal, coin):
+        average = cal.lots.average(coin)
+        if average is not None:
+            cal.acq_costs[coin] = average
+
+    def acquire(self, cal, coin, amount, price, total, jpy=None):
+        self.update(cal, coin)
+
+    def dispose(self, cal, coin, amount, lots=()):
+        jpy = sum(used * price for _, used, price in lots)
+        return cal.ceil(jpy / amount) if amount > 0 else 0
+
+
+# Cost basis methods by name
+cost_bases = {method.name: method for method in [MovingAverage, TotalAverage, Fifo]}
 
 
 class ProfitCalculator:
+    # Defaults of the registry, which a registry given to the calculator extends.
+    # Coins, wallets and years of the loaded history are added to them by prepare.
     # variation of coins
     coins = [
         'jpy', 'btc', 'bch', 'eth', 'mona', 'xem',
@@ -333,55 +860,155 @@ class ProfitCalculator:
     zaif_api = 'https://zaif.jp/zaif_chart_api/v1/history'
     # Endpoint of Bitbank API
     bitbank_api = "https://public.bitbank.cc/{pair}/candlestick/1min/{time}"
+    # Format of checkpoints written by save
+    checkpoint_version = 4
+    # Symbols whose chart is taken from Bitbank
+    bitbank_symbols = [
+        "BTC_JPY",
+        "BCC_JPY",
+        "MONA_JPY",
+    ]
 
-    def __init__(self, initial={}):
+    def __init__(
+        self, initial={}, prices=None, offline=False, fetcher=None, checkpoint_dir=None, metrics=None,
+        cost_basis='moving_average', track_lots=False, registry=None,
+    ):
+        # registry: dict with any of 'coins', 'wallets', 'hard_forks' (coin -> {'src', 'timestamp'}),
+        # 'hard_fork_wallets' and 'bitbank_symbols', added to the defaults above; see read_registry
+        self.registry = {} if registry is None else registry
+        registry = self.registry
+        self.hf_timestamps = dict(ProfitCalculator.hf_timestamps, **registry.get('hard_forks', {}))
+        self.hf_wallets = list(ProfitCalculator.hf_wallets) + list(registry.get('hard_fork_wallets', []))
+        self.bitbank_symbols = set(ProfitCalculator.bitbank_symbols) | set(registry.get('bitbank_symbols', []))
         # Amount of every coin
-        self.coins = {}
-        for coin in ProfitCalculator.coins:
-            self.coins[coin] = {w: 0 for w in wallets.values()}
-        # Acquisition cost of every coin
-        self.acq_costs = {k: 0 for k in ProfitCalculator.coins}
-
-        self.hf_flags = {
-            'bch': False,
-        }
+        self.coins = Ledger(
+            ProfitCalculator.coins + list(registry.get('coins', [])),
+            list(wallets.values()) + list(registry.get('wallets', [])),
+        )
+        # Acquisition cost of every coin; 0 for coins never acquired
+        self.acq_costs = collections.defaultdict(int, {k: 0 for k in self.coins})
+        # method of acquisition costs; one of cost_bases
+        if cost_basis not in cost_bases:
+            raise Exception('Unsupported cost basis: {}'.format(cost_basis))
+        self.cost_basis = cost_bases[cost_basis]()
+        # lots of every coin and wallet, if tracked or the cost basis method uses them; see LotIndex
+        self.lots = LotIndex() if track_lots or self.cost_basis.uses_lots else None
+        # called with (row, coin, lots consumed as (time, amount, price)) for every sale when lots are tracked
+        self.on_sale = None
 
-        self.profit = {
-            2017: 0,
-            2018: 0,
-            2019: 0,
-        }
+        self.hf_flags = {coin: False for coin in self.hf_timestamps}
+
+        # profit of every year, from the years of the history on
+        self.profit = {}
         self.deposit_jpy = 0
         self.last_tx_time = None
         self.trade = TradeHistory()
-        # cache of chart from Bitbank
-        self.chart_cache = {
-            "BTC_JPY": None,
-            "BCC_JPY": None,
-            "MONA_JPY": None,
-        }
+        # cache of fair values; with offline, prices missing in it raise an error
+        self.prices = PriceStore() if prices is None else prices
+        self.offline = offline
+        self.fetcher = PriceFetcher() if fetcher is None else fetcher
+        # directory of checkpoints; None to disable them
+        self.checkpoint_dir = checkpoint_dir
+        # timers, counters and latencies of this calculator; see Metrics
+        self.metrics = Metrics() if metrics is None else metrics
 
-    def save(self, year):
-        obj = {
+    def state(self):
+        # State of the replay, as written to checkpoints
+        return {
             "coins": self.coins,
             "acq_costs": self.acq_costs,
+            "cost_basis": self.cost_basis,
+            "lots": self.lots,
             "hf_flags": self.hf_flags,
             "deposit_jpy": self.deposit_jpy,
             "profit": self.profit,
-            "last_tx_time": self.last_tx_time
+            "last_tx_time": self.last_tx_time,
         }
-        with open("cache_" + str(year) + '.pickle', mode="wb") as f:
-            pickle.dump(obj, f)
 
-    def load(self, year):
-        with open("cache" + str(year) + '.pickle', mode="rb") as f:
+    def restore(self, state):
+        # the cost basis method is that of the state
+        self.coins = state["coins"]
+        self.acq_costs = collections.defaultdict(int, state["acq_costs"])
+        self.cost_basis = state["cost_basis"]
+        self.lots = state["lots"]
+        self.hf_flags.update(state["hf_flags"])
+        self.deposit_jpy = state["deposit_jpy"]
+        self.profit = state["profit"]
+        self.last_tx_time = state["last_tx_time"]
+
+    def save(self, path, position=0, fingerprint='', profits=None, total_profits=None, state=None):
+        # State before the transaction at position, with profits of the transactions before it;
+        # state is that of this calculator by default
+        obj = dict(self.state() if state is None else state)
+        obj.update({
+            "version": ProfitCalculator.checkpoint_version,
+            "position": position,
+            "fingerprint": fingerprint,
+            "profits": None if profits is None else profits[:position].copy(),
+            "total_profits": None if total_profits is None else total_profits[:position].copy(),
+        })
+        with open(path, mode="wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path, same_method=False):
+        # With same_method, as to continue a calculation, a checkpoint of another cost basis
+        # method is an error; otherwise the calculator takes the method of the checkpoint.
+        with open(path, mode="rb") as f:
             obj = pickle.load(f)
-            self.coins = obj.coins
-            self.acq_costs = obj.acq_costs
-            self.hf_flags = obj.hf_flags
-            self.deposit_jpy = obj.deposit_jpy
-            self.profit = obj.profit
-            self.last_tx_time = obj.last_tx_time
+        if obj.get("version") != ProfitCalculator.checkpoint_version:
+            raise Exception('Unsupported checkpoint version: {}'.format(obj.get("version")))
+        if same_method and obj["cost_basis"].name != self.cost_basis.name:
+            raise Exception('Checkpoint is of cost basis {}'.format(obj["cost_basis"].name))
+        self.restore(obj)
+        return obj
+
+    def configuration(self):
+        # Settings which checkpoints depend on besides the history; checkpoints of other
+        # versions or cost basis methods, with lots tracked differently or another registry
+        # never match and are kept apart
+        configuration = '{}:{}'.format(ProfitCalculator.checkpoint_version, self.cost_basis.name)
+        configuration += ':lots' if self.lots is not None else ''
+        if len(self.registry) > 0:
+            configuration += ':' + json.dumps(self.registry, sort_keys=True)
+        return configuration
+
+    def fingerprint(self, hashes):
+        return hashlib.sha1(self.configuration().encode() + hashes.tobytes()).hexdigest()[:16]
+
+    def checkpoint_path(self):
+        # Directory of the checkpoints of this configuration in checkpoint_dir, e.g. fifo-lots-<hash>
+        name = self.cost_basis.name + ('-lots' if self.lots is not None else '')
+        digest = hashlib.sha1(self.configuration().encode()).hexdigest()[:8]
+        return os.path.join(self.checkpoint_dir, '{}-{}'.format(name, digest))
+
+    def checkpoints(self):
+        # (position, fingerprint, path) of the checkpoints of this configuration, latest first
+        found = []
+        for path in glob.glob(os.path.join(self.checkpoint_path(), 'checkpoint_*.pickle')):
+            _, position, fingerprint = os.path.basename(path)[:-len('.pickle')].split('_')
+            found.append((int(position), fingerprint, path))
+        return sorted(found, reverse=True)
+
+    def checkpoint(self, position, hashes, profits, total_profits, state=None):
+        fingerprint = self.fingerprint(hashes[:position])
+        path = os.path.join(self.checkpoint_path(), 'checkpoint_{:012d}_{}.pickle'.format(position, fingerprint))
+        self.save(path, position, fingerprint, profits, total_profits, state)
+
+    def resume(self, hashes, profits, total_profits):
+        # Restore the latest checkpoint whose transactions are all unchanged.
+        # Returns the position to replay from; later checkpoints of this configuration are removed.
+        for position, fingerprint, path in self.checkpoints():
+            if position <= len(hashes) and fingerprint == self.fingerprint(hashes[:position]):
+                obj = self.load(path, same_method=True)
+                profits[:position] = obj["profits"]
+                total_profits[:position] = obj["total_profits"]
+                break
+        else:
+            position = 0
+        for later, _, path in self.checkpoints():
+            if later > position:
+                os.remove(path)
+        return position
 
     def ceil(self, data):
         return data
@@ -400,294 +1027,945 @@ class ProfitCalculator:
         return round(coin, 8) == 0
 
     def print_status(self):
-        for year in self.profit.keys():
-            print('-- ', year, ' ---------------------------------')
-            for key, row in self.coins.items():
-                if sum(self.coins[key].values()) > 0:
-                    print(key.upper() + ':', round(sum(self.coins[key].values()), 9))
-                    for wallet, amount in self.coins[key].items():
-                        if round(amount, 9) > 0:
-                            print('   ', wallet, ':', round(amount, 9))
-                    print(key.upper() + ' Acquisition cost:', round(self.acq_costs[key], 9))
-            print()
-            print('As of:', self.last_tx_time)
-            print('Profits:', self.profit[year])
-            print('Spent:', round(self.deposit_jpy))
-            print(
-                'Acquisition cost:',
-                sum([sum(self.coins[c].values()) * self.acq_costs[c] for c in ProfitCalculator.coins])
-            )
-            print()
+        with self.metrics.timer('reporting'):
+            for year in self.profit.keys():
+                print('-- ', year, ' ---------------------------------')
+                for key in self.coins:
+                    total = self.coins.total(key)
+                    if total > 0:
+                        print(key.upper() + ':', round(total, 9))
+                        for wallet, amount in self.coins[key].items():
+                            if round(amount, 9) > 0:
+                                print('   ', wallet, ':', round(amount, 9))
+                        print(key.upper() + ' Acquisition cost:', round(self.acq_costs[key], 9))
+                print()
+                print('As of:', self.last_tx_time)
+                print('Profits:', self.profit[year])
+                print('Spent:', round(self.deposit_jpy))
+                print(
+                    'Acquisition cost:',
+                    sum([self.coins.total(c) * self.acq_costs[c] for c in self.coins])
+                )
+                print()
+
+    def snapshot(self):
+        # Machine-readable status: holdings, acquisition costs and profits
+        return {
+            'holdings': {
+                coin: {wallet: amount for wallet, amount in self.coins[coin].items() if amount != 0}
+                for coin in self.coins if self.coins.total(coin) != 0
+            },
+            'totals': {coin: self.coins.total(coin) for coin in self.coins},
+            'cost_basis': self.cost_basis.name,
+            'acq_costs': dict(self.acq_costs),
+            'profit': dict(self.profit),
+            'deposit_jpy': self.deposit_jpy,
+            'last_tx_time': None if self.last_tx_time is None else self.last_tx_time.isoformat(),
+        }
 
     def get_coin_type(self, market):
         return market.split('_')[0]
 
-    def load_history(self, data_list):
-        for key, value in data_list.items():
-            for item in value:
-                if os.path.exists(item['path']):
-                    self.trade.append_data(pd.read_csv(item['path']), key, item.get('currency', ''))
-        self.trade.data['time'] = pd.to_datetime(self.trade.data['time'], utc=True)
-        self.trade.data = self.trade.data.sort_values(by='time', ascending=True)
-        self.trade.data = self.trade.data.reset_index(drop=True)
+    def prepare(self, data=None):
+        # Add the coins, wallets and years of the loaded history, or of data, to the universe,
+        # and the symbols of JPY markets traded on Bitbank to the charts taken from Bitbank
+        if data is None:
+            data = self.trade.data
+        if len(data) == 0:
+            return
+        markets = [str(market) for market in data['market'].unique()]
+        coins = sorted({coin for market in markets for coin in market.split('_')})
+        self.coins.intern(coins, [str(wallet) for wallet in data['exchange'].unique()])
+        for coin in coins:
+            self.acq_costs.setdefault(coin, 0)
+        for year in sorted(data['time'].dt.year.unique()):
+            self.profit.setdefault(int(year), 0)
+        bitbank = data['exchange'] == wallets['BITBANK']
+        for market in data['market'][bitbank].astype(str).unique():
+            if market.endswith('_jpy'):
+                self.bitbank_symbols.add(market.upper().replace('BCH', 'BCC'))
 
-    def get_fair_value(self, time, symbol, exchange):
-        time = time - timedelta(seconds=time.second)
+    def load_directory(self, directory, **kwargs):
+        # Load every csv file in directory; see scan_directory
+        self.load_history(scan_directory(directory, list(self.coins)), **kwargs)
+
+    def load_history(self, data_list, workers=1, cache_dir=None):
+        # With cache_dir, parsed files are kept in an IngestCache there
+        sources = list_sources(data_list)
+        if cache_dir is None:
+            read, jobs = read_history, sources
+        else:
+            cache = IngestCache(cache_dir)
+            read, jobs = read_cached, cache.jobs(sources)
+        with self.metrics.timer('ingestion'):
+            if workers > 1 and len(jobs) > 1:
+                # files are independent until they are merged by time
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(read, jobs))
+            else:
+                results = [read(job) for job in jobs]
+            if cache_dir is not None:
+                cache.update(sources, [entry for _, entry in results])
+                results = [frame for frame, _ in results]
+        self.metrics.count('files', len(sources))
+        with self.metrics.timer('sort'):
+            self.trade.concat_data(results)
+        self.prepare()
+
+    def price_key(self, time, symbol, exchange):
+        # Key of the price store for a fair value: (symbol, source of the chart, minute)
+        time = time - timedelta(seconds=time.second, microseconds=time.microsecond)
         symbol_bitbank = symbol.replace('BCH', 'BCC')
-        if self.isZaif(exchange) or symbol_bitbank not in self.chart_cache.keys():
-            params = {
-                'symbol': symbol.upper(),
-                'resolution': '1',
-                'from': int(time.timestamp()),
-                'to': int(time.timestamp()),
-            }
-            response = requests.get(ProfitCalculator.zaif_api, params=params)
-            if response.status_code != 200:
-                raise Exception('return status code is {}'.format(response.status_code))
-            data = json.loads(response.json())
-            count = data['data_count']
-            if (count != 0):
-                data = pd.DataFrame.from_dict(data['ohlc_data'])
-            return data['close'][0]
+        if self.isZaif(exchange) or symbol_bitbank not in self.bitbank_symbols:
+            source = wallets['ZAIF']
         elif self.isBitbank(exchange):
-            time = time - timedelta(hours=9)
-            ts = int(time.timestamp()) * 1000
-            if self.chart_cache[symbol_bitbank] is None or ts not in self.chart_cache[symbol_bitbank].index:
-                url = self.bitbank_api.format(pair=symbol_bitbank.lower(), time=time.strftime('%Y%m%d'))
-                response = requests.get(url)
-                data = response.json()
-                if data['success'] == 0:
-                    print('time=', time)
-                    print('symbol_bitbank=', symbol_bitbank)
-                    print('url=', url)
-                    print(data)
-                    raise Exception()
-                ohlcv = data['data']['candlestick'][0]["ohlcv"]
-                df = pd.DataFrame(ohlcv, columns=['open', 'high', 'low', 'close', 'volume', 'time'], dtype=float)
-                df['time'] = df['time'].astype('int')
-                self.chart_cache[symbol_bitbank] = df.set_index('time')
-            return self.chart_cache[symbol_bitbank].loc[ts]['close']
+            source = wallets['BITBANK']
         else:
-            print("ERROR")
-            raise
+            raise Exception('No chart of {} on {}'.format(symbol, exchange))
+        return symbol, source, int(time.timestamp())
+
+    def get_fair_value(self, time, symbol, exchange):
+        key = self.price_key(time, symbol, exchange)
+        price = self.prices.get(*key)
+        self.metrics.count('price_requests')
+        if price is not None:
+            self.metrics.count('price_cache_hits')
+            return price
+        self.metrics.count('price_cache_misses')
+        if self.offline:
+            raise Exception('No price of {} at {} in the store'.format(symbol, time))
+        self.fetch_prices(*key)
+        price = self.prices.get(*key)
+        if price is None:
+            raise Exception('No price of {} at {}'.format(symbol, time))
+        return price
+
+    def fetch_day(self, source, minute):
+        # Day of the chart which has the minute; Bitbank charts are split by days in UTC
+        if source == wallets['BITBANK']:
+            minute -= 9 * 3600
+        return minute // 86400
+
+    def fetch_prices(self, symbol, source, minute):
+        # Store a whole day of the chart which has the minute
+        self.prices.put_many(symbol, source, self.download_prices((symbol, source, minute)))
+
+    def download_prices(self, key):
+        # A whole day of the chart which has the minute; safe to run in threads
+        symbol, source, minute = key
+        start = self.fetch_day(source, minute) * 86400
+        begin = clock.perf_counter()
+        if source == wallets['ZAIF']:
+            prices = self.fetch_zaif(start, symbol)
+        else:
+            prices = self.fetch_bitbank(start, symbol.replace('BCH', 'BCC'))
+        self.metrics.observe('price_fetch', clock.perf_counter() - begin)
+        self.metrics.count('price_fetches_' + source)
+        return prices
+
+    def fetch_zaif(self, start, symbol):
+        # Returns close prices of the day from start keyed by minute
+        params = {
+            'symbol': symbol.upper(),
+            'resolution': '1',
+            'from': start,
+            'to': start + 86400 - 60,
+        }
+        response = self.fetcher.get(self.zaif_api, params=params)
+        if response.status_code != 200:
+            raise Exception('return status code is {}'.format(response.status_code))
+        data = json.loads(response.json())
+        # time of ohlc_data is in milliseconds
+        return {int(item['time']) // 1000: item['close'] for item in data['ohlc_data']}
+
+    def fetch_bitbank(self, start, symbol_bitbank):
+        # Returns close prices of the day in UTC from start keyed by minute
+        time = pd.Timestamp(start, unit='s')
+        url = self.bitbank_api.format(pair=symbol_bitbank.lower(), time=time.strftime('%Y%m%d'))
+        response = self.fetcher.get(url)
+        if response.status_code != 200:
+            raise Exception('return status code is {}'.format(response.status_code))
+        data = response.json()
+        if data['success'] == 0:
+            raise Exception('No chart of {} on {} from {}: {}'.format(symbol_bitbank, time.date(), url, data.get('data')))
+        ohlcv = data['data']['candlestick'][0]["ohlcv"]
+        df = pd.DataFrame(ohlcv, columns=['open', 'high', 'low', 'close', 'volume', 'time'], dtype=float)
+        # chart is in UTC while transaction times are in JST
+        minutes = df['time'].astype('int64') // 1000 + 9 * 3600
+        return dict(zip(minutes, df['close']))
+
+    def fair_value_requests(self):
+        # (time, symbol, exchange) of every fair value which calculate will ask
+        data = self.trade.data
+        market = data['market'].astype(str)
+        tx_type = data['type'].astype(str)
+        btc = market.str.endswith('_btc')
+        coin = market.str.split('_').str[0].str.upper() + '_JPY'
+        source = market.str.split('_').str[-1].str.upper() + '_JPY'
+        bid = btc & (tx_type == tx_types['BID'])
+        ask = btc & (tx_type == tx_types['ASK'])
+        ico = tx_type == tx_types['ICO']
+        wanted = []
+        for mask, symbol in [(bid, 'BTC_JPY'), (bid | ask, coin), (ico, source)]:
+            wanted.append(pd.DataFrame({
+                'time': data['time'][mask],
+                'symbol': symbol[mask] if isinstance(symbol, pd.Series) else symbol,
+                'exchange': data['exchange'][mask].astype(str),
+            }))
+        return pd.concat(wanted, ignore_index=True)
+
+    def missing_price_days(self):
+        # {(symbol, source, day): price key} of the days of charts needed by calculate
+        # but missing in the price store
+        self.prepare()
+        days = {}
+        for time, symbol, exchange in self.fair_value_requests().itertuples(index=False):
+            key = self.price_key(time, symbol, exchange)
+            if self.prices.get(*key) is None:
+                days.setdefault((key[0], key[1], self.fetch_day(key[1], key[2])), key)
+        return days
+
+    def fetch_price_days(self, keys):
+        # Download the days of charts of the price keys and store them
+        # downloads run concurrently while the store is written from this thread
+        for key, prices in zip(keys, self.fetcher.map(self.download_prices, keys)):
+            self.prices.put_many(key[0], key[1], prices)
+
+    def prefetch_prices(self):
+        # Fetch every fair value needed by calculate, one request per symbol and day.
+        # Returns the number of requests issued.
+        with self.metrics.timer('prefetch'):
+            days = self.missing_price_days()
+            if len(days) > 0 and self.offline:
+                raise Exception('{} days of prices are not in the store'.format(len(days)))
+            self.fetch_price_days(list(days.values()))
+        return len(days)
+
+    def add_lot(self, row, coin, amount, price, first=False):
+        # New lot in the wallet of row when lots are tracked; first clears the lots left of the coin
+        if self.lots is not None and coin != 'jpy':
+            if first:
+                self.lots.clear(coin)
+            self.lots.acquire(coin, row['exchange'], amount, price, row['time'].value)
+
+    def take_lots(self, row, coin, amount, sale=False):
+        # Consume lots in the wallet of row and return them as (time, amount, price).
+        # Coins of a sale beyond the lots of the wallet are valued at the current cost,
+        # as coins deposited without lots are, and the lots of a sale are passed to on_sale.
+        if self.lots is None or coin == 'jpy':
+            return []
+        consumed = self.lots.dispose(coin, row['exchange'], amount)
+        self.cost_basis.update(self, coin)
+        if sale:
+            short = amount - sum(used for _, used, _ in consumed)
+            if round(short, 8) > 0:
+                consumed.append((row['time'].value, short, self.acq_costs[coin]))
+            if self.on_sale is not None:
+                self.on_sale(row, coin, consumed)
+        return consumed
 
     def bid(self, row): # sell
         # Unit of fee in bid is jpy or btc
         coin_type = self.get_coin_type(row['market'])
+        lots = self.take_lots(row, coin_type, row['amount'], sale=True)
         if row['market'].endswith('_jpy'):
-            self.profit[row['time'].year] += (row['price'] - self.ceil(self.acq_costs[coin_type])) * row['amount']
+            cost = self.cost_basis.dispose(self, coin_type, row['amount'], lots)
+            self.profit[row['time'].year] += (row['price'] - cost) * row['amount']
             if self.isZaif(row['exchange']) or self.isBitbank(row['exchange']):
-                self.coins['jpy'][row['exchange']] += row['price'] * row['amount'] - row['cost']
+                self.coins.add('jpy', row['exchange'], row['price'] * row['amount'] - row['cost'])
             elif self.isBf(row['exchange']):
-                self.coins['jpy'][row['exchange']] += math.floor(row['price'] * row['amount']) - row['cost']
+                self.coins.add('jpy', row['exchange'], math.floor(row['price'] * row['amount']) - row['cost'])
         elif row['market'].endswith('_btc'):
             # Call an API to get a fair value at this moment.
             btc_fair_value = self.get_fair_value(row['time'], 'BTC_JPY', row['exchange'])
             alt_fair_value = self.get_fair_value(row['time'], coin_type.upper() + '_JPY', row['exchange'])
             # profits arise from selling ALT coins
-            self.profit[row['time'].year] += (alt_fair_value - self.ceil(self.acq_costs[coin_type])) * row['amount']
+            cost = self.cost_basis.dispose(self, coin_type, row['amount'], lots)
+            self.profit[row['time'].year] += (alt_fair_value - cost) * row['amount']
 
             # update acquisition cost of BTC
             new_coins = row['price'] * row['amount']
-            total_btc = sum(self.coins['btc'].values())
+            total_btc = self.coins.total('btc')
             if self.has_coin(total_btc):
                 # If this was first time to have BTC
-                self.coins['btc'][row['exchange']] = new_coins - row['cost']
-                self.acq_costs['btc'] = btc_fair_value
+                self.coins.set('btc', row['exchange'], new_coins - row['cost'])
             else:
-                former_cost = self.acq_costs['btc'] * total_btc
-                cost = former_cost + btc_fair_value * new_coins
-                self.coins['btc'][row['exchange']] += new_coins - row['cost']
-                self.acq_costs['btc'] = cost / sum(self.coins['btc'].values())
-        self.coins[coin_type][row['exchange']] -= row['amount']
+                self.coins.add('btc', row['exchange'], new_coins - row['cost'])
+            # the lot is the BTC net of the fee, which is valued at all BTC acquired
+            if round(new_coins - row['cost'], 8) > 0:
+                price = btc_fair_value * new_coins / (new_coins - row['cost'])
+                self.add_lot(row, 'btc', new_coins - row['cost'], price, self.has_coin(total_btc))
+            self.cost_basis.acquire(self, 'btc', new_coins, btc_fair_value, total_btc)
+        self.coins.add(coin_type, row['exchange'], -row['amount'])
 
     def ask(self, row): # buy
         # Unit of fee in ask is buying currency
         coin_type = self.get_coin_type(row['market'])
-        total_coins = sum(self.coins[coin_type].values())
+        total_coins = self.coins.total(coin_type)
         if row['market'].endswith('_jpy'):
             jpy = row['amount'] * row['price']
             if self.isZaif(row['exchange']) or self.isBitbank(row['exchange']):
-                self.coins['jpy'][row['exchange']] -= jpy
+                self.coins.add('jpy', row['exchange'], -jpy)
             elif self.isBf(row['exchange']):
-                self.coins['jpy'][row['exchange']] -= self.ceil(jpy)
+                self.coins.add('jpy', row['exchange'], -self.ceil(jpy))
 
             # 手数料(bitbankはJPY)
             if self.isBitbank(row['exchange']):
-                self.coins['jpy'][row['exchange']] -= row['cost']
+                self.coins.add('jpy', row['exchange'], -row['cost'])
             else:
-                self.coins[coin_type][row['exchange']] -= row['cost']
+                self.coins.add(coin_type, row['exchange'], -row['cost'])
+                self.take_lots(row, coin_type, row['cost'])
 
             if self.has_coin(total_coins):
                 # if this was the first time to by this type of coin
-                self.coins[coin_type][row['exchange']] = row['amount']
-                self.acq_costs[coin_type] = row['price']
+                self.coins.set(coin_type, row['exchange'], row['amount'])
             else:
-                former_cost = self.acq_costs[coin_type] * total_coins
-                cost = former_cost + jpy
-                self.coins[coin_type][row['exchange']] += row['amount']
-                self.acq_costs[coin_type] = cost / sum(self.coins[coin_type].values())
+                self.coins.add(coin_type, row['exchange'], row['amount'])
+            self.add_lot(row, coin_type, row['amount'], row['price'], self.has_coin(total_coins))
+            self.cost_basis.acquire(self, coin_type, row['amount'], row['price'], total_coins)
         elif row['market'].endswith('_btc'):
-            self.coins['btc'][row['exchange']] -= row['price'] * row['amount']
+            self.coins.add('btc', row['exchange'], -(row['price'] * row['amount']))
+            # BTC paid for the coins is sold
+            self.take_lots(row, 'btc', row['price'] * row['amount'], sale=True)
             # fair value at this moment
             fair_value = self.get_fair_value(row['time'], coin_type.upper() + '_JPY', row['exchange'])
 
             # 手数料(bitbankはBTC)
             if self.isBitbank(row['exchange']):
-                self.coins['btc'][row['exchange']] -= row['cost']
+                self.coins.add('btc', row['exchange'], -row['cost'])
+                self.take_lots(row, 'btc', row['cost'])
             else:
-                self.coins[coin_type][row['exchange']] -= row['cost']
+                self.coins.add(coin_type, row['exchange'], -row['cost'])
+                self.take_lots(row, coin_type, row['cost'])
 
             if self.has_coin(total_coins):
                 # if this was the first time to by this type of coin
-                self.coins[coin_type][row['exchange']] = row['amount']
-                self.acq_costs[coin_type] = fair_value
+                self.coins.set(coin_type, row['exchange'], row['amount'])
             else:
-                former_cost = self.acq_costs[coin_type] * total_coins
-                cost = former_cost + fair_value * row['amount']
-                self.coins[coin_type][row['exchange']] += row['amount']
-                self.acq_costs[coin_type] = cost / sum(self.coins[coin_type].values())
+                self.coins.add(coin_type, row['exchange'], row['amount'])
+            self.add_lot(row, coin_type, row['amount'], fair_value, self.has_coin(total_coins))
+            self.cost_basis.acquire(self, coin_type, row['amount'], fair_value, total_coins)
 
     def purchase(self, row):
         self.deposit_jpy += row['cost']
         coin_type = row['market']
-        total_coins = sum(self.coins[coin_type].values())
+        total_coins = self.coins.total(coin_type)
         if self.has_coin(total_coins):
             # if not coin yet
-            self.coins[coin_type][row['exchange']] = row['amount']
-            self.acq_costs[coin_type] = row['cost'] / sum(self.coins[coin_type].values())
+            self.coins.set(coin_type, row['exchange'], row['amount'])
         else:
-            # if you already have coins, take moving average.
-            former_cost = self.acq_costs[coin_type] * total_coins
-            new_cost = former_cost + row['cost']
-            self.coins[coin_type][row['exchange']] += row['amount']
-            self.acq_costs[coin_type] = new_cost / sum(self.coins[coin_type].values())
+            self.coins.add(coin_type, row['exchange'], row['amount'])
+        self.add_lot(row, coin_type, row['amount'], row['cost'] / row['amount'], self.has_coin(total_coins))
+        self.cost_basis.acquire(self, coin_type, row['amount'], None, total_coins, jpy=row['cost'])
 
     def deposit(self, row):
-        self.coins[row['market']][row['exchange']] += row['amount'] - row['cost']
+        self.coins.add(row['market'], row['exchange'], row['amount'] - row['cost'])
         if row['market'] == 'jpy':
             self.deposit_jpy += row['amount'] - row['cost']
+        self.deposit_lots(row)
 
     def withdraw(self, row):
-        self.coins[row['market']][row['exchange']] -= row['amount'] + row['cost']
+        self.coins.add(row['market'], row['exchange'], -(row['amount'] + row['cost']))
         if row['market'] == 'jpy':
             self.deposit_jpy -= row['amount'] + row['cost']
+        else:
+            if self.lots is not None:
+                self.lots.withdraw(row['market'], row['exchange'], row['amount'])
+            self.take_lots(row, row['market'], row['cost'])
+
+    def deposit_lots(self, row):
+        # Deposited coins take the lots in transit, and the rest are valued at the current cost
+        if self.lots is not None and row['market'] != 'jpy':
+            self.lots.deposit(
+                row['market'], row['exchange'], row['amount'] - row['cost'],
+                self.acq_costs[row['market']], row['time'].value,
+            )
+            self.cost_basis.update(self, row['market'])
 
     def send(self, row):
         self.withdraw(row)
 
     def receive(self, row):
-        self.coins[row['market']][row['exchange']] += row['amount'] - row['cost']
+        self.coins.add(row['market'], row['exchange'], row['amount'] - row['cost'])
+        self.deposit_lots(row)
 
     def ico(self, row):
         [target, source] = row['market'].split('_')
-        self.coins[source][row['exchange']] -= row['price']
+        self.coins.add(source, row['exchange'], -row['price'])
+        lots = self.take_lots(row, source, row['price'], sale=True)
         # self.coins[target][row['exchange']] += row['amount']
         source_fair_value = self.get_fair_value(row['time'], source.upper() + '_JPY', row['exchange'])
         target_fair_value = source_fair_value * row['price'] / row['amount']
-        self.acq_costs[target] = target_fair_value
-        self.profit[row['time'].year] += (source_fair_value - self.ceil(self.acq_costs[source])) * row['price']
+        # coins of the ICO are new, whatever was deposited before
+        self.add_lot(row, target, row['amount'], target_fair_value, first=True)
+        self.cost_basis.acquire(self, target, row['amount'], target_fair_value, 0)
+        cost = self.cost_basis.dispose(self, source, row['price'], lots)
+        self.profit[row['time'].year] += (source_fair_value - cost) * row['price']
 
     def fee(self, row):
-        self.coins[row['market']][row['exchange']] -= row['amount']
+        self.coins.add(row['market'], row['exchange'], -row['amount'])
+        self.take_lots(row, row['market'], row['amount'])
 
     def check_hard_fork(self, row):
         for coin, flag in self.hf_flags.items():
-            if row['time'].timestamp() > ProfitCalculator.hf_timestamps[coin]['timestamp'] and not flag:
-                for wallet, coins in self.coins[ProfitCalculator.hf_timestamps[coin]['src']].items():
+            if row['time'].timestamp() > self.hf_timestamps[coin]['timestamp'] and not flag:
+                for wallet, coins in self.coins[self.hf_timestamps[coin]['src']].items():
                     if wallet in self.hf_wallets:
-                        self.coins[coin][wallet] = coins
+                        self.coins.set(coin, wallet, coins)
+                        # coins of a hard fork cost nothing
+                        if self.lots is not None:
+                            timestamp = self.hf_timestamps[coin]['timestamp']
+                            self.lots.acquire(coin, wallet, coins, 0, timestamp * 10 ** 9)
+                            self.cost_basis.update(self, coin)
                 self.hf_flags[coin] = True
 
-    def calculate(self, num_of_tx=-1):
-        inv_tx_types = {v: k for k, v in tx_types.items()}
-        prev_year = self.trade.data.iloc[0]['time'].year
-        print(prev_year)
-        for index, row in self.trade.data.iterrows():
-            # if prev_year != row['time'].year:
-            #     self.save(prev_year)
-            prev_profit = self.profit[row['time'].year]
-            self.check_hard_fork(row)
-            # Reflection
-            try:
-                key = inv_tx_types[row['type']].lower()
-            except KeyError as e:
-                traceback.print_exc()
-                raise Exception('Unsupported transaction')
-            if hasattr(self, key):
-                action = getattr(self, key)
-                if callable(action):
-                    action(row)
-                    self.last_tx_time = row['time']
-                    self.trade.data.loc[index, 'total_profit'] = self.profit[row['time'].year]
-                    self.trade.data.loc[index, 'profit'] = self.profit[row['time'].year] - prev_profit
+    def actions(self):
+        # Dispatch table from transaction types to methods; None for types without one
+        actions = {}
+        for key, value in tx_types.items():
+            action = getattr(self, key.lower(), None)
+            actions[value] = action if callable(action) else None
+        return actions
+
+    def pending_hard_fork(self):
+        # Timestamp of the earliest hard fork which is not applied yet, or None
+        pending = [
+            self.hf_timestamps[coin]['timestamp']
+            for coin, flag in self.hf_flags.items() if not flag
+        ]
+        return min(pending) if len(pending) > 0 else None
+
+    def next_hard_fork(self, seconds):
+        # Index of the first row after a hard fork which is not applied yet
+        pending = self.pending_hard_fork()
+        if pending is None:
+            return len(seconds)
+        return int(np.searchsorted(seconds, pending, side='right'))
+
+    def process(self, row, actions):
+        # Apply a transaction. Returns its profit and the total profit of the year,
+        # or None for transaction types without an action.
+        if row['type'] not in actions:
+            raise Exception('Unsupported transaction: {}'.format(row['type']))
+        action = actions[row['type']]
+        if action is None:
+            return None
+        year = row['time'].year
+        if year not in self.profit:
+            self.profit[year] = 0
+        if year != self.cost_basis.year:
+            self.cost_basis.new_year(self, year)
+        prev_profit = self.profit[year]
+        action(row)
+        self.last_tx_time = row['time']
+        return self.profit[year] - prev_profit, self.profit[year]
+
+    def count_rows(self, counts):
+        # Add {transaction type: rows} to the metrics as rows_<type>
+        names = {value: key.lower() for key, value in tx_types.items()}
+        for type, count in counts.items():
+            if count > 0:
+                self.metrics.count('rows_' + names.get(type, str(type)), count)
+
+    def report(self, verbosity, index, count=None):
+        # Output after the transaction at index
+        if verbosity == 'all':
+            self.print_status()
+        elif verbosity == 'progress' and (index + 1) % self.progress_every == 0:
+            of = '' if count is None else ' of {}'.format(count)
+            print('Processed {}{} transactions, as of {}'.format(index + 1, of, self.last_tx_time))
+
+    def calculate(
+        self, num_of_tx=-1, verbosity='final', progress_every=10000, checkpoint_every=None, resume=False,
+        on_year=None,
+    ):
+        # With checkpoint_dir, a checkpoint is written at every year boundary and
+        # every checkpoint_every transactions, and resume starts from the latest valid one.
+        # on_year is called with the index of the first transaction of every year after the first.
+        # verbosity is one of
+        #   'none': no output
+        #   'progress': a line every progress_every transactions and the final status
+        #   'final': only the final status
+        #   'all': the status after every transaction
+        if verbosity not in ['none', 'progress', 'final', 'all']:
+            raise Exception('Unsupported verbosity: {}'.format(verbosity))
+        self.progress_every = progress_every
+        self.prepare()
+        data = self.trade.data
+        actions = self.actions()
+        if verbosity == 'all':
+            print(data.iloc[0]['time'].year)
+        # plain columns instead of a Series per row
+        columns = [data[column].tolist() for column in TradeHistory.columns]
+        seconds = (data['time'] - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+        profits = data['profit'].to_numpy(dtype=float, copy=True)
+        total_profits = data['total_profit'].to_numpy(dtype=float, copy=True)
+        start = 0
+        if self.checkpoint_dir is not None:
+            os.makedirs(self.checkpoint_path(), exist_ok=True)
+            hashes = self.trade.hashes()
+            if resume:
+                start = self.resume(hashes, profits, total_profits)
+        hard_fork = self.next_hard_fork(seconds)
+        prev_year = None
+        with self.metrics.timer('replay'):
+            for index, values in enumerate(itertools.islice(zip(*columns), start, None), start):
+                row = dict(zip(TradeHistory.columns, values))
+                year = row['time'].year
+                if self.checkpoint_dir is not None and index > start and (
+                    year != prev_year or (checkpoint_every and index % checkpoint_every == 0)
+                ):
+                    self.checkpoint(index, hashes, profits, total_profits)
+                if on_year is not None and index > start and year != prev_year:
+                    on_year(index)
+                prev_year = year
+                if index >= hard_fork:
+                    self.check_hard_fork(row)
+                    hard_fork = self.next_hard_fork(seconds)
+                result = self.process(row, actions)
+                if result is not None:
+                    profits[index], total_profits[index] = result
+                self.report(verbosity, index, len(data))
+                if index == num_of_tx:
+                    break
+        end = num_of_tx + 1 if start <= num_of_tx < len(data) else len(data)
+        self.count_rows(data['type'].iloc[start:end].value_counts().to_dict())
+        self.cost_basis.settle(self)
+        data['profit'] = profits
+        data['total_profit'] = total_profits
+        if verbosity in ['progress', 'final']:
+            self.print_status()
+
+    def calculate_stream(self, rows, verbosity='final', progress_every=10000, on_row=None):
+        # Replay rows in time order, e.g. from stream_history, without holding the history.
+        # profit/total_profit of each row are set before it is passed to on_row.
+        # Give prepare of this calculator to stream_history, so that Bitbank charts of the
+        # history are known before the first row as in calculate.
+        if verbosity not in ['none', 'progress', 'final', 'all']:
+            raise Exception('Unsupported verbosity: {}'.format(verbosity))
+        self.progress_every = progress_every
+        actions = self.actions()
+        hard_fork = self.pending_hard_fork()
+        counts = {}
+        with self.metrics.timer('replay'):
+            for index, row in enumerate(rows):
+                if hard_fork is not None and row['time'].timestamp() > hard_fork:
+                    self.check_hard_fork(row)
+                    hard_fork = self.pending_hard_fork()
+                result = self.process(row, actions)
+                if result is not None:
+                    row['profit'], row['total_profit'] = result
+                if on_row is not None:
+                    on_row(row)
+                counts[row['type']] = counts.get(row['type'], 0) + 1
+                self.report(verbosity, index)
+        self.count_rows(counts)
+        self.cost_basis.settle(self)
+        if verbosity in ['progress', 'final']:
+            self.print_status()
+
+    def calculate_years(self, workers=2, verbosity='final'):
+        # Replay every year in its own process, seeded with the state at its start from the
+        # checkpoint written at that year boundary, and merge profits of their transactions.
+        # A year without a valid checkpoint at its start is replayed in the process of the year
+        # before it, and the checkpoints missing at year boundaries are written, so that the next
+        # run is parallel over all years. Workers read the price store read-only; prefetch_prices first.
+        if verbosity not in ['none', 'progress', 'final']:
+            raise Exception('Unsupported verbosity with workers: {}'.format(verbosity))
+        if self.checkpoint_dir is None:
+            raise Exception('Replay by year needs checkpoint_dir')
+        if self.on_sale is not None:
+            raise Exception('Lots of sales are passed to on_sale only by calculate')
+        self.prepare()
+        os.makedirs(self.checkpoint_path(), exist_ok=True)
+        data = self.trade.data
+        if len(data) == 0:
+            if verbosity in ['progress', 'final']:
+                self.print_status()
+            return
+        hashes = self.trade.hashes()
+        years = data['time'].dt.year.to_numpy()
+        bounds = [int(index) for index in np.flatnonzero(np.diff(years)) + 1]
+        # checkpoints of this configuration for the history as it is; the others are stale and removed
+        valid = {}
+        for position, fingerprint, path in self.checkpoints():
+            if position <= len(hashes) and fingerprint == self.fingerprint(hashes[:position]):
+                valid[position] = path
+            else:
+                os.remove(path)
+        starts = [0] + [position for position in bounds if position in valid]
+        ends = starts[1:] + [len(data)]
+        prices = self.prices
+        if isinstance(prices, PriceStore):
+            prices = PriceStore(prices.path, readonly=True)
+        options = {'cost_basis': self.cost_basis.name, 'track_lots': self.lots is not None, 'registry': self.registry}
+        jobs = [
+            (data.iloc[start:end].reset_index(drop=True), valid.get(start), prices, options)
+            for start, end in zip(starts, ends)
+        ]
+        profits = np.zeros(len(data))
+        total_profits = np.zeros(len(data))
+        states = {}
+        with self.metrics.timer('replay'), ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as executor:
+            # a single job, as in the first run, is replayed in this process
+            results = executor.map(replay_years, jobs) if len(jobs) > 1 else map(replay_years, jobs)
+            for start, end, result in zip(starts, ends, results):
+                profits[start:end], total_profits[start:end], bounded, state, counters = result
+                for index, pickled in bounded:
+                    states[start + index] = pickled
+                # profits of the years of this job are final
+                state = pickle.loads(state)
+                for year in range(years[start], years[end - 1] + 1):
+                    self.profit[int(year)] = state["profit"].get(int(year), 0)
+                for name, n in counters.items():
+                    self.metrics.count(name, n)
+                if verbosity == 'progress':
+                    print('Replayed {} to {}, transactions {} to {}'.format(years[start], years[end - 1], start, end - 1))
+        # the state after the last year, with profits of every year merged in
+        profit = self.profit
+        self.restore(state)
+        self.profit.update(profit)
+        for position, pickled in sorted(states.items()):
+            self.checkpoint(position, hashes, profits, total_profits, pickle.loads(pickled))
+        data['profit'] = profits
+        data['total_profit'] = total_profits
+        if verbosity in ['progress', 'final']:
             self.print_status()
-            if index == num_of_tx:
-                break
-        # self.trade.data.to_csv('foo.csv')
 
     def output(self, path):
-        pass
+        # Write the transactions with their profits; read them back by TradeHistory.load
+        self.trade.save(path)
 
+    def variant(self, cost_basis):
+        # Calculator of the loaded history under another cost basis, sharing its prices
+        cal = ProfitCalculator(
+            prices=self.prices, offline=self.offline, fetcher=self.fetcher, metrics=self.metrics,
+            cost_basis=cost_basis, registry=self.registry,
+        )
+        cal.trade.data = self.trade.data.copy(deep=False)
+        return cal
 
-if __name__ == "__main__":
-    # List of csv files for transaction history
-    data_list = {
-        csv_types['ZAIF_TRADE']: [
-            {'path': 'csv/52150_2017_1.csv'},
-            {'path': 'csv/52150_2018_1.csv'},
-        ],
-        csv_types['ZAIF_CREDIT_TRADE']: [
-            {'path': 'csv/52150_2017_2.csv'},
-        ],
-        csv_types['ZAIF_DEPOSIT']: [
-            {'path': 'csv/jpy_deposit.csv', 'currency': 'jpy'},
-            {'path': 'csv/btc_deposit.csv', 'currency': 'btc'},
-            {'path': 'csv/mona_deposit.csv', 'currency': 'mona'},
-        ],
-        csv_types['ZAIF_WITHDRAW']: [
-            {'path': 'csv/btc_withdraw.csv', 'currency': 'btc'},
-            {'path': 'csv/bch_withdraw.csv', 'currency': 'bch'},
-            {'path': 'csv/eth_withdraw.csv', 'currency': 'eth'},
-            {'path': 'csv/mona_withdraw.csv', 'currency': 'mona'},
-        ],
-        csv_types['ZAIF_ERC20_DEPOSIT']: [
-            {'path': 'csv/erc20_deposit.csv', 'currency': 'erc20.cms'},
-        ],
-        csv_types['ZAIF_BONUS']: [
-            {'path': 'csv/obtain_bonus.csv'},
-        ],
-        csv_types['BITFLYER']: [
-            {'path': 'csv/TradeHistory.csv'},
-        ],
-        csv_types['BITBANK']: [
-            {'path': 'csv/trade_history_bitbank.csv'},
-        ],
-        csv_types['MONAPPY']: [
-            {'path': 'csv/monappy_transaction.csv'},
-        ],
-        # custom csv files
-        csv_types['BITBANK_DEPOSIT_WITHDRAW']: [
-            {'path': 'csv/deposit_withdraw_bitbank.csv'},
-        ],
-        csv_types['ZAIF_PURCHASE']: [
-            {'path': 'csv/purchase.csv'},
-        ],
-        csv_types['BCINFO_PURCHASE']: [
-            {'path': 'csv/purchase_bcinfo.csv'},
-        ],
-        csv_types['MONAWALLET']: [
-            {'path': 'csv/mona_wallet.csv'},
-        ],
-        csv_types['TIPMONA']: [
-            {'path': 'csv/tipmona.csv'},
-        ],
-        csv_types['ICO']: [
-            {'path': 'csv/ico.csv'}
-        ],
+    def compare_cost_bases(self, methods, workers=1):
+        # Replay the loaded history under every cost basis method and return {method: snapshot}.
+        # Rows and fair values are built once and shared by all methods in a single pass,
+        # or, with workers, every method runs in its own process on the price store read-only;
+        # prefetch_prices first then.
+        if workers > 1:
+            prices = self.prices
+            if isinstance(prices, PriceStore):
+                prices = PriceStore(prices.path, readonly=True)
+            jobs = [(method, self.trade.data, prices, self.registry) for method in methods]
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                return dict(executor.map(replay_cost_basis, jobs))
+        calculators = {method: self.variant(method) for method in methods}
+        for cal in calculators.values():
+            cal.prepare()
+        data = self.trade.data
+        columns = [data[column].tolist() for column in TradeHistory.columns]
+        seconds = (data['time'] - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+        actions = {method: cal.actions() for method, cal in calculators.items()}
+        hard_forks = {method: cal.next_hard_fork(seconds) for method, cal in calculators.items()}
+        profits = {method: np.zeros(len(data)) for method in methods}
+        total_profits = {method: np.zeros(len(data)) for method in methods}
+        with self.metrics.timer('replay'):
+            for index, values in enumerate(zip(*columns)):
+                row = dict(zip(TradeHistory.columns, values))
+                for method, cal in calculators.items():
+                    if index >= hard_forks[method]:
+                        cal.check_hard_fork(row)
+                        hard_forks[method] = cal.next_hard_fork(seconds)
+                    result = cal.process(row, actions[method])
+                    if result is not None:
+                        profits[method][index], total_profits[method][index] = result
+        for method, cal in calculators.items():
+            cal.cost_basis.settle(cal)
+            cal.trade.data['profit'] = profits[method]
+            cal.trade.data['total_profit'] = total_profits[method]
+        return {method: cal.snapshot() for method, cal in calculators.items()}
+
+    def fair_values(self, mask, symbols):
+        # Fair values of the rows in mask, zero for the others, looking up every price key once
+        data = self.trade.data
+        values = np.zeros(len(data))
+        index = np.flatnonzero(mask)
+        if len(index) == 0:
+            return values
+        seconds = (data['time'].iloc[index] - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+        minutes = (seconds // 60 * 60).astype('int64')
+        exchange = per_category(data['exchange'], str)[index]
+        symbol = symbols[index]
+        # sources of charts as in price_key
+        bitbank_symbol = np.isin([s.replace('BCH', 'BCC') for s in symbol], list(self.bitbank_symbols))
+        zaif = (exchange == wallets['ZAIF']) | ~bitbank_symbol
+        unknown = ~zaif & (exchange != wallets['BITBANK'])
+        if unknown.any():
+            raise Exception('No chart of {} on {}'.format(symbol[unknown][0], exchange[unknown][0]))
+        source = np.where(zaif, wallets['ZAIF'], wallets['BITBANK'])
+        codes, keys = pd.MultiIndex.from_arrays([symbol, source, minutes]).factorize()
+        first = pd.Series(np.arange(len(codes))).groupby(codes).first().to_numpy()
+        prices = np.zeros(len(keys))
+        hits = 0
+        for i, (key, row) in enumerate(zip(keys, first)):
+            price = self.prices.get(*key)
+            if price is None:
+                # counted as a request and a miss by get_fair_value
+                price = self.get_fair_value(pd.Timestamp(key[2], unit='s', tz='UTC'), key[0], exchange[row])
+            else:
+                hits += 1
+            prices[i] = price
+        self.metrics.count('price_requests', hits)
+        self.metrics.count('price_cache_hits', hits)
+        values[index] = prices[codes]
+        return values
+
+    def total_average(self):
+        # 総平均法 over the loaded history with grouped operations instead of a replay, from
+        # empty holdings. Returns a frame indexed by (year, coin) of the amount held at the start
+        # of the year, the amount and JPY acquired, the amount sold and its proceeds, the
+        # average cost of the year and the profit. As with TotalAverage, holdings are those of
+        # the ledger, except that the first purchase of a coin is added to its wallet rather
+        # than replacing it. Fair values are looked up only for rows on BTC markets and ICOs.
+        self.prepare()
+        data = self.trade.data
+        columns = ['opening', 'acquired', 'acquired_jpy', 'sold', 'proceeds', 'average', 'profit']
+        if len(data) == 0:
+            return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_arrays([[], []], names=['year', 'coin']))
+        # string operations run once per category
+        coin = per_category(data['market'], lambda market: market.split('_')[0])
+        quote = per_category(data['market'], lambda market: market.split('_')[-1])
+        jpy_market = per_category(data['market'], lambda market: market.endswith('_jpy')).astype(bool)
+        btc_market = per_category(data['market'], lambda market: market.endswith('_btc')).astype(bool)
+        tx_type = per_category(data['type'], str)
+        wallet = per_category(data['exchange'], str)
+        price, cost, amount = [data[column].to_numpy(dtype=float) for column in ['price', 'cost', 'amount']]
+        year = data['time'].dt.year.to_numpy()
+        seconds = (data['time'] - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+        bitbank = wallet == wallets['BITBANK']
+        bid = tx_type == tx_types['BID']
+        ask = tx_type == tx_types['ASK']
+        purchase = tx_type == tx_types['PURCHASE']
+        ico = tx_type == tx_types['ICO']
+        btc_fair = self.fair_values(bid & btc_market, np.full(len(data), 'BTC_JPY', dtype=object))
+        alt_fair = self.fair_values(
+            (bid | ask) & btc_market, per_category(data['market'], lambda market: market.split('_')[0].upper() + '_JPY'),
+        )
+        source_fair = self.fair_values(
+            ico, per_category(data['market'], lambda market: market.split('_')[-1].upper() + '_JPY'),
+        )
+
+        def flows(parts, names):
+            # one frame of (mask, coin, values...) parts over the rows in their masks
+            frames = []
+            for mask, coins, *values in parts:
+                frame = {'row': np.flatnonzero(mask)}
+                frame['coin'] = coins[mask] if isinstance(coins, np.ndarray) else coins
+                for name, value in zip(names, values):
+                    frame[name] = value[mask] if isinstance(value, np.ndarray) else value
+                frames.append(pd.DataFrame(frame))
+            frame = pd.concat(frames, ignore_index=True)
+            frame['year'] = year[frame['row'].to_numpy()]
+            return frame
+
+        # changes of the ledger, as the transaction handlers make them
+        deltas = flows([
+            (bid, coin, wallet, -amount),
+            (bid & btc_market, 'btc', wallet, price * amount - cost),
+            (ask & jpy_market, coin, wallet, amount - np.where(bitbank, 0, cost)),
+            (ask & btc_market, 'btc', wallet, -price * amount - np.where(bitbank, cost, 0)),
+            (ask & btc_market, coin, wallet, amount - np.where(bitbank, 0, cost)),
+            (purchase, coin, wallet, amount),
+            ((tx_type == tx_types['DEPOSIT']) | (tx_type == tx_types['RECEIVE']), coin, wallet, amount - cost),
+            ((tx_type == tx_types['WITHDRAW']) | (tx_type == tx_types['SEND']), coin, wallet, -(amount + cost)),
+            (tx_type == tx_types['FEE'], coin, wallet, -amount),
+            (ico, quote, wallet, -price),
+        ], ['wallet', 'delta'])
+        for fork, flag in self.hf_flags.items():
+            # the forked coin is set to the source coin in each wallet before the first row after the fork
+            row = int(np.searchsorted(seconds, self.hf_timestamps[fork]['timestamp'], side='right'))
+            if flag or row >= len(data):
+                continue
+            before = deltas[deltas['row'] < row].groupby(['coin', 'wallet'])['delta'].sum()
+            source = self.hf_timestamps[fork]['src']
+            forked = [
+                {'row': row, 'coin': fork, 'wallet': hf_wallet, 'year': year[row],
+                 'delta': before.get((source, hf_wallet), 0) - before.get((fork, hf_wallet), 0)}
+                for hf_wallet in self.hf_wallets
+            ]
+            deltas = pd.concat([deltas, pd.DataFrame(forked)], ignore_index=True)
+        acquisitions = flows([
+            (ask & jpy_market, coin, amount, amount * price),
+            (ask & btc_market, coin, amount, alt_fair * amount),
+            (purchase, coin, amount, cost),
+            (bid & btc_market, 'btc', price * amount, btc_fair * price * amount),
+            (ico, coin, amount, source_fair * price),
+        ], ['acquired', 'acquired_jpy'])
+        sales = flows([
+            (bid & jpy_market, coin, amount, price * amount),
+            (bid & btc_market, coin, amount, alt_fair * amount),
+            (ico, quote, price, source_fair * price),
+        ], ['sold', 'proceeds'])
+
+        years = np.unique(year)
+        closing = deltas.groupby(['year', 'coin'])['delta'].sum().unstack(fill_value=0)
+        closing = closing.reindex(years, fill_value=0).cumsum()
+        table = pd.concat([
+            acquisitions.groupby(['year', 'coin'])[['acquired', 'acquired_jpy']].sum(),
+            sales.groupby(['year', 'coin'])[['sold', 'proceeds']].sum(),
+        ], axis=1).fillna(0)
+        coins = sorted(set(closing.columns) | set(table.index.get_level_values('coin')))
+        table = table.reindex(pd.MultiIndex.from_product([years, coins], names=['year', 'coin']), fill_value=0)
+        # holdings at the start of a year are those at the end of the previous one
+        opening = closing.reindex(columns=coins, fill_value=0).shift(1, fill_value=0).clip(lower=0)
+        table['opening'] = opening.stack().reindex(table.index).to_numpy()
+        averages = []
+        average = pd.Series(0.0, index=coins)
+        for current in years:
+            part = table.loc[current]
+            amount_held = part['opening'] + part['acquired']
+            jpy_held = part['opening'] * average + part['acquired_jpy']
+            average = (jpy_held / amount_held.where(amount_held > 0)).fillna(average)
+            averages.append(average.to_numpy())
+        table['average'] = np.concatenate(averages)
+        table['profit'] = table['proceeds'] - table['average'] * table['sold']
+        return table[columns]
+
+
+def per_category(series, function):
+    # function of every category of a categorical column, spread over its rows
+    categories = [str(category) for category in series.cat.categories] + ['']
+    values = np.empty(len(categories), dtype=object)
+    values[:] = [function(category) for category in categories]
+    # code -1 of missing values takes the last one
+    return values[series.cat.codes.to_numpy()]
+
+
+def replay_cost_basis(job):
+    # Calculate a history under one cost basis method; run in worker processes
+    method, data, prices, registry = job
+    cal = ProfitCalculator(prices=prices, offline=True, cost_basis=method, registry=registry)
+    cal.trade.data = data
+    cal.calculate(verbosity='none')
+    return method, cal.snapshot()
+
+
+def scan_directory(directory, coins=None):
+    # data_list of the csv files in directory, with their types detected from headers.
+    # Files of types which need a currency are named after one of coins, as btc_deposit.csv;
+    # coins are those of ProfitCalculator by default. Other files are reported and left out.
+    coins = ProfitCalculator.coins if coins is None else coins
+    data_list = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        detected = exchanges.detect(path, coins)
+        if detected is None:
+            print('Unknown csv file:', path)
+            continue
+        type, currency = detected
+        if currency is None:
+            print('Unknown currency of {} file, to be named as btc_{}.csv or listed in a data list:'.format(type, type), path)
+            continue
+        data_list.setdefault(type, []).append({'path': path, 'currency': currency})
+    return data_list
+
+
+def read_data_list(path):
+    # data_list from a JSON file; relative paths are from the directory of the file
+    with open(path) as f:
+        data_list = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for items in data_list.values():
+        for item in items:
+            item['path'] = os.path.join(base, item['path'])
+    return data_list
+
+
+def replay_years(job):
+    # Replay the transactions of some years from the checkpoint at their start, or from the
+    # beginning without one; run in worker processes. Returns profits and total profits of
+    # the transactions, [(index, pickled state)] at the year boundaries after the first year,
+    # the pickled final state and counters of the metrics.
+    data, path, prices, options = job
+    cal = ProfitCalculator(prices=prices, offline=True, **options)
+    if path is not None:
+        cal.load(path, same_method=True)
+    cal.trade.data = data
+    states = []
+    cal.calculate(
+        verbosity='none',
+        on_year=lambda index: states.append((index, pickle.dumps(cal.state(), protocol=pickle.HIGHEST_PROTOCOL))),
+    )
+    state = pickle.dumps(cal.state(), protocol=pickle.HIGHEST_PROTOCOL)
+    return data['profit'].to_numpy(), data['total_profit'].to_numpy(), states, state, cal.metrics.counters
+
+
+def read_registry(path):
+    # Registry of coins, wallets, hard forks and Bitbank charts from a JSON file; see ProfitCalculator
+    with open(path) as f:
+        registry = json.load(f)
+    unknown = set(registry) - {'coins', 'wallets', 'hard_forks', 'hard_fork_wallets', 'bitbank_symbols'}
+    if len(unknown) > 0:
+        raise Exception('Unknown keys in {}: {}'.format(path, ', '.join(sorted(unknown))))
+    return registry
+
+
+def batch_price_days(job):
+    # Days of charts missing in the shared price store for an account; run in worker processes
+    name, data_list, prices_path, ingest_dir = job
+    cal = ProfitCalculator(prices=PriceStore(prices_path, readonly=True), offline=True)
+    cal.load_history(data_list, cache_dir=ingest_dir)
+    return cal.missing_price_days()
+
+
+def batch_calculate(job):
+    # Calculate an account with the shared, read-only price store; run in worker processes
+    name, data_list, prices_path, ingest_dir = job
+    begin = clock.perf_counter()
+    cal = ProfitCalculator(prices=PriceStore(prices_path, readonly=True), offline=True)
+    cal.load_history(data_list, cache_dir=ingest_dir)
+    if len(cal.trade.data) > 0:
+        cal.calculate(verbosity='none')
+    snapshot = cal.snapshot()
+    snapshot['transactions'] = len(cal.trade.data)
+    snapshot['seconds'] = clock.perf_counter() - begin
+    return name, snapshot
+
+
+def run_batch(config_dir, output_dir, workers=1, prices_path='prices.sqlite3', fetcher=None):
+    # Calculate every account configured by <account>.json in config_dir.
+    # Prices of all accounts are fetched once into prices_path, which the workers then
+    # share read-only. Writes <account>.json and summary.json into output_dir.
+    begin = clock.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for path in sorted(glob.glob(os.path.join(config_dir, '*.json'))):
+        name = os.path.basename(path)[:-len('.json')]
+        ingest_dir = os.path.join(output_dir, 'ingest', name)
+        jobs.append((name, read_data_list(path), prices_path, ingest_dir))
+    fetching = ProfitCalculator(prices=PriceStore(prices_path), fetcher=fetcher)
+    fetching.prices.connect()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        days = {}
+        for missing in executor.map(batch_price_days, jobs):
+            days.update(missing)
+        fetching.fetch_price_days(list(days.values()))
+        fetching.prices.close()
+        results = list(executor.map(batch_calculate, jobs))
+    for name, snapshot in results:
+        with open(os.path.join(output_dir, name + '.json'), mode='w') as f:
+            json.dump(snapshot, f, indent=2)
+    elapsed = clock.perf_counter() - begin
+    summary = {
+        'accounts': len(results),
+        'price_requests': len(days),
+        'seconds': elapsed,
+        'accounts_per_minute': len(results) / elapsed * 60,
+        'profit': {name: snapshot['profit'] for name, snapshot in results},
     }
+    with open(os.path.join(output_dir, 'summary.json'), mode='w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
 
-    cal = ProfitCalculator()
-    cal.load_history(data_list)
-    cal.calculate()
-    cal.print_status()
+if __name__ == "__main__":
+    # python profits.py runs the command-line interface; see cli.py
+    import cli
+    cli.main()
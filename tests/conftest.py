@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# the modules of the repository are imported from its root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profits
+from benchmark import FakePrices
+
+
+@pytest.fixture
+def fixtures():
+    # directory of the fixture history, its recorded prices and expected profits
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.fixture
+def data_list(fixtures):
+    return profits.read_data_list(os.path.join(fixtures, 'history', 'data_list.json'))
+
+
+@pytest.fixture
+def recorded_prices(fixtures):
+    # fair values of every transaction of the fixture history
+    return profits.PriceStore(os.path.join(fixtures, 'prices.sqlite3'), readonly=True)
+
+
+@pytest.fixture
+def fixture_calculator(data_list, recorded_prices):
+    # Calculator of the fixture history; over the recorded prices and offline unless prices are given
+    def calculator(prices=None, **kwargs):
+        if prices is None:
+            prices = recorded_prices
+            kwargs.setdefault('offline', True)
+        cal = profits.ProfitCalculator(prices=prices, **kwargs)
+        cal.load_history(data_list)
+        return cal
+    return calculator
+
+
+@pytest.fixture
+def fake_prices():
+    # FakePrices(price=None): prices of every minute, recording the charts asked
+    return FakePrices
+
+
+def history(rows):
+    # transactions of (market, type, price, cost, amount, time, exchange)
+    df = pd.DataFrame(rows, columns=['market', 'type', 'price', 'cost', 'amount', 'time', 'exchange'])
+    df['profit'] = 0.0
+    df['total_profit'] = 0.0
+    return df
+
+
+@pytest.fixture
+def calculate_rows():
+    # Calculate the given transactions under a cost basis method, at a fair value of 50 for everything
+    def calculate(rows, method='moving_average', on_sale=None, **kwargs):
+        cal = profits.ProfitCalculator(prices=FakePrices(50.0), offline=True, cost_basis=method, **kwargs)
+        cal.on_sale = on_sale
+        cal.trade.concat_data([history(rows)])
+        cal.calculate(verbosity='none')
+        return cal
+    return calculate
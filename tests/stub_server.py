@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Answers as the chart APIs of Zaif (/zaif) and Bitbank (/<pair>/candlestick/1min/<day>),
+    # with the close of every minute being 1000 + its minute of the day
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.append((time.monotonic(), self.path))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            throttled = server.throttle > 0
+            if throttled:
+                server.throttle -= 1
+        try:
+            time.sleep(server.latency)
+            if throttled:
+                self.send_response(429)
+                self.send_header('Retry-After', str(server.retry_after))
+                self.end_headers()
+                return
+            url = urlparse(self.path)
+            if url.path.startswith('/zaif'):
+                query = parse_qs(url.query)
+                start, end = int(query['from'][0]), int(query['to'][0])
+                data = [{'time': minute * 1000, 'close': 1000.0 + minute % 86400 // 60} for minute in range(start, end + 1, 60)]
+                # Zaif returns JSON encoded as a JSON string
+                body = json.dumps(json.dumps({'data_count': len(data), 'ohlc_data': data}))
+            else:
+                start = int(pd.Timestamp(url.path.split('/')[-1], tz='UTC').timestamp())
+                ohlcv = [[1, 1, 1, 1000.0 + i, 1, (start + i * 60) * 1000] for i in range(1440)]
+                body = json.dumps({'success': 1, 'data': {'candlestick': [{'ohlcv': ohlcv}]}})
+                if not server.success:
+                    # as Bitbank answers for a pair it does not list
+                    body = json.dumps({'success': 0, 'data': {'code': 10000}})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body.encode())
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+class StubServer(ThreadingHTTPServer):
+    # Local chart server; latency is added to every response, the next throttle
+    # requests are answered by 429 with Retry-After of retry_after seconds, and
+    # Bitbank answers success 0 without success
+    daemon_threads = True
+
+    def __init__(self, latency=0, throttle=0, retry_after=0, success=True):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.success = success
+        self.lock = threading.Lock()
+        # (monotonic time, path) of every request
+        self.hits = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.url = 'http://127.0.0.1:{}'.format(self.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def use(self, cal):
+        # Point the chart APIs of a calculator to this server
+        cal.zaif_api = self.url + '/zaif'
+        cal.bitbank_api = self.url + '/{pair}/candlestick/1min/{time}'
+        return cal
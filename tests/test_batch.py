@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+import profits
+from stub_server import StubServer
+
+
+@pytest.fixture
+def accounts(tmp_path, data_list):
+    # two accounts with the fixture history and one with a part of it, so that their days overlap
+    directory = tmp_path / 'accounts'
+    directory.mkdir()
+    part = {type: data_list[type] for type in ['zaif_trade', 'bitbank', 'ico']}
+    for name, account in [('a', data_list), ('b', data_list), ('c', part)]:
+        (directory / (name + '.json')).write_text(json.dumps(account))
+    return str(directory)
+
+
+def test_run_batch(tmp_path, accounts, monkeypatch):
+    prices = str(tmp_path / 'prices.sqlite3')
+    output = str(tmp_path / 'results')
+    with StubServer() as server:
+        monkeypatch.setattr(profits.ProfitCalculator, 'zaif_api', server.url + '/zaif')
+        monkeypatch.setattr(profits.ProfitCalculator, 'bitbank_api', server.url + '/{pair}/candlestick/1min/{time}')
+        fetcher = profits.PriceFetcher(rate=None)
+        summary = profits.run_batch(accounts, output, workers=2, prices_path=prices, fetcher=fetcher)
+        # every day of a chart is fetched once for all accounts
+        paths = [path for _, path in server.hits]
+        assert summary['accounts'] == 3
+        assert summary['price_requests'] == len(paths) == len(set(paths)) > 0
+        # the second run finds every price in the store
+        again = profits.run_batch(accounts, output, workers=2, prices_path=prices, fetcher=fetcher)
+        assert again['price_requests'] == 0
+        assert len(server.hits) == len(paths)
+    for name in ['a', 'b', 'c']:
+        cal = profits.ProfitCalculator(prices=profits.PriceStore(prices, readonly=True), offline=True)
+        cal.load_history(profits.read_data_list(os.path.join(accounts, name + '.json')))
+        cal.calculate(verbosity='none')
+        with open(os.path.join(output, name + '.json')) as f:
+            result = json.load(f)
+        del result['transactions'], result['seconds']
+        assert result == json.loads(json.dumps(cal.snapshot()))
+        assert summary['profit'][name] == cal.snapshot()['profit']
@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import cli
+import profits
+
+@pytest.fixture
+def config(tmp_path, fixtures, data_list):
+    # config of the fixture history, with results in tmp_path
+    shutil.copy(os.path.join(fixtures, 'prices.sqlite3'), str(tmp_path / 'prices.sqlite3'))
+    path = tmp_path / 'profits.json'
+    path.write_text(json.dumps({
+        'data': data_list,
+        'prices': 'prices.sqlite3',
+        'history': 'history',
+        'output': 'results',
+        'offline': True,
+    }))
+    return str(path)
+
+
+@pytest.mark.parametrize('method', list(profits.cost_bases))
+def test_report_of_every_cost_basis(config, capsys, method):
+    cli.main(['ingest', '--config', config])
+    capsys.readouterr()
+    cli.main(['calculate', '--config', config, '--cost-basis', method, '--format', 'json'])
+    calculated = json.loads(capsys.readouterr().out)
+    cli.main(['report', '--config', config, '--format', 'json'])
+    reported = json.loads(capsys.readouterr().out)
+    assert reported['cost_basis'] == method
+    assert reported == calculated
+
+
+def run(capsys, *argv):
+    capsys.readouterr()
+    cli.main(list(argv))
+    return capsys.readouterr()
+
+
+def test_stream_and_lots(config, capsys, tmp_path):
+    run(capsys, 'ingest', '--config', config)
+    calculated = json.loads(run(capsys, 'calculate', '--config', config, '--cost-basis', 'fifo', '--format', 'json').out)
+    lots = str(tmp_path / 'lots.csv')
+    streamed = run(
+        capsys, 'calculate', '--config', config, '--cost-basis', 'fifo', '--format', 'json',
+        '--stream', '--chunksize', '50', '--lots', lots, '--profile',
+    )
+    assert json.loads(streamed.out) == calculated
+    assert 'replay' in streamed.err
+    with open(lots) as f:
+        assert f.readline().strip() == 'time,market,exchange,coin,lot_time,amount,price'
+        assert len(f.readlines()) > 0
+    # only the state of a streamed calculation is kept
+    assert json.loads(run(capsys, 'report', '--config', config, '--format', 'json').out) == calculated
+    with pytest.raises(Exception, match='calculate --stream'):
+        cli.main(['report', '--config', config, '--format', 'csv'])
+
+
+def test_compare_and_total_average(config, capsys):
+    run(capsys, 'ingest', '--config', config)
+    compared = json.loads(run(capsys, 'compare', '--config', config, '--format', 'json').out)
+    assert sorted(compared) == sorted(profits.cost_bases)
+    for method in ['moving_average', 'fifo']:
+        calculated = json.loads(run(capsys, 'calculate', '--config', config, '--cost-basis', method, '--format', 'json').out)
+        assert compared[method]['profit'] == calculated['profit']
+    by_year = json.loads(run(capsys, 'total-average', '--config', config, '--format', 'json').out)
+    assert by_year.keys() == compared['total_average']['profit'].keys()
+
+
+def test_profits_py_runs_the_cli():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, os.path.join(root, 'profits.py'), '--help'], capture_output=True, text=True, check=True,
+    )
+    for command in ['ingest', 'calculate', 'compare', 'total-average', 'batch', 'report']:
+        assert command in result.stdout
@@ -0,0 +1,87 @@
+import pytest
+
+import profits
+
+
+def held(cal, coin):
+    # amount of the lots of coin in wallets
+    return sum(lots.amount for wallet, lots in cal.lots.lots[coin].items() if wallet is not None)
+
+
+sales = [
+    ('btc', '購入', 0, 100, 1, '2017-02-01', 'zaif'),
+    ('btc_jpy', '売り', 200, 0, 1, '2017-03-01', 'zaif'),
+    ('btc_jpy', '買い', 300, 0, 1, '2017-04-01', 'zaif'),
+    ('btc_jpy', '買い', 500, 0, 1, '2018-01-05', 'zaif'),
+    ('btc_jpy', '売り', 600, 0, 1.5, '2018-02-01', 'zaif'),
+]
+
+
+@pytest.mark.parametrize('method, expected', [
+    ('moving_average', {2017: 100, 2018: 300}),
+    ('total_average', {2017: 0, 2018: 375}),
+    ('fifo', {2017: 100, 2018: 350}),
+])
+def test_profits_by_method(method, expected, calculate_rows):
+    cal = calculate_rows(sales, method)
+    assert cal.profit == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('track_lots', [False, True])
+def test_fifo_btc_spent_on_alt_coins(track_lots, calculate_rows):
+    # BTC paid for MONA takes the oldest lot, so the sale is charged the lot of 200
+    rows = [
+        ('btc_jpy', '買い', 100, 0, 1, '2017-02-01', 'zaif'),
+        ('btc_jpy', '買い', 200, 0, 1, '2017-02-02', 'zaif'),
+        ('mona_btc', '買い', 0.5, 0, 2, '2017-02-03', 'zaif'),
+        ('btc_jpy', '売り', 300, 0, 1, '2017-02-04', 'zaif'),
+    ]
+    cal = calculate_rows(rows, 'fifo', track_lots=track_lots)
+    assert cal.profit == pytest.approx({2017: 100})
+    assert cal.coins.total('btc') == pytest.approx(0)
+    assert held(cal, 'btc') == pytest.approx(0)
+
+
+def test_fifo_fees_and_transfers(calculate_rows):
+    rows = [
+        ('btc_jpy', '買い', 100, 0, 1, '2017-02-01', 'zaif'),
+        ('btc_jpy', '買い', 200, 0, 1, '2017-02-02', 'zaif'),
+        # the fee is taken from the lot of 100
+        ('btc', '手数料', 0, 0, 0.5, '2017-02-03', 'zaif'),
+        # moved to bitFlyer, where the rest of the lot of 100 stays the oldest
+        ('btc', '出金', 0, 0, 0.5, '2017-02-04', 'zaif'),
+        ('btc', '預入', 0, 0, 0.5, '2017-02-05', 'bitflyer'),
+        # sent outside, taking the rest of the lot of 100
+        ('btc', '外部送付', 0, 0, 0.5, '2017-02-06', 'bitflyer'),
+        ('btc_jpy', '売り', 300, 0, 1, '2017-02-07', 'zaif'),
+    ]
+    cal = calculate_rows(rows, 'fifo')
+    assert cal.profit == pytest.approx({2017: 300 - 200})
+    assert cal.coins.total('btc') == pytest.approx(0)
+    assert held(cal, 'btc') == pytest.approx(0)
+
+
+def test_fifo_btc_fee_on_bid(calculate_rows):
+    # the lot is the BTC net of the fee of 0.1 BTC, so the last sale takes all of it
+    rows = [
+        ('mona_jpy', '買い', 10, 0, 10, '2017-02-01', 'zaif'),
+        ('mona_btc', '売り', 0.1, 0.1, 10, '2017-02-02', 'zaif'),
+        ('btc_jpy', '売り', 300, 0, 0.9, '2017-02-03', 'zaif'),
+    ]
+    cal = calculate_rows(rows, 'fifo')
+    assert cal.coins.total('btc') == pytest.approx(0)
+    assert held(cal, 'btc') == pytest.approx(0)
+    # MONA sold at 50 for 10, and the 0.9 BTC left of 1 BTC worth 50 sold at 300
+    assert cal.profit == pytest.approx({2017: (50 - 10) * 10 + 300 * 0.9 - 50})
+
+
+@pytest.mark.parametrize('method', list(profits.cost_bases))
+def test_deposit_without_withdrawal(method, calculate_rows):
+    # coins deposited from outside are valued at the current cost by every method
+    rows = [
+        ('btc_jpy', '買い', 100, 0, 1, '2017-02-01', 'zaif'),
+        ('btc', '預入', 0, 0, 1, '2017-02-02', 'zaif'),
+        ('btc_jpy', '売り', 300, 0, 2, '2017-02-03', 'zaif'),
+    ]
+    cal = calculate_rows(rows, method)
+    assert cal.profit == pytest.approx({2017: 400})
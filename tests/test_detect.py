@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import exchanges
+import profits
+
+
+def write(directory, name, header):
+    path = os.path.join(str(directory), name)
+    with open(path, mode='w', encoding='utf-8') as f:
+        f.write(','.join(header) + '\n2017-01-01 00:00:00\n')
+    return path
+
+
+@pytest.mark.parametrize('name, header, expected', [
+    ('bitflyer.csv', ['取引日時', '通貨', '取引種別', '価格', 'BTC'], ('bitflyer', '')),
+    ('trades.csv', ['日時', '取引種別', '価格', 'マーケット', '数量', '取引手数料'], ('zaif_trade', '')),
+    ('btc_deposit.csv', ['日時', '金額'], ('zaif_deposit', 'btc')),
+    ('mona_withdraw.csv', ['日時', '金額', '手数料'], ('zaif_withdraw', 'mona')),
+    ('erc20.csv', ['日時', '金額', 'トークン'], ('zaif_erc20_deposit', '')),
+])
+def test_detect(tmp_path, name, header, expected):
+    assert exchanges.detect(write(tmp_path, name, header), profits.ProfitCalculator.coins) == expected
+
+
+@pytest.mark.parametrize('name, expected', [
+    # zaif_purchase and bcinfo_purchase have the same columns; the file name tells them apart
+    ('bcinfo_purchase.csv', 'bcinfo_purchase'),
+    ('zaif_purchase.csv', 'zaif_purchase'),
+    ('purchase.csv', 'zaif_purchase'),
+])
+def test_purchase_tie_break(tmp_path, name, expected):
+    path = write(tmp_path, name, ['日時', '数量', '通貨', '価格'])
+    assert exchanges.detect(path) == (expected, '')
+
+
+@pytest.mark.parametrize('name, expected', [
+    # so do bitbank_deposit_withdraw and monawallet
+    ('monawallet.csv', 'monawallet'),
+    ('mona_wallet_2018.csv', 'monawallet'),
+    ('bitbank_deposit_withdraw.csv', 'bitbank_deposit_withdraw'),
+    ('deposit_withdraw.csv', 'bitbank_deposit_withdraw'),
+])
+def test_deposit_withdraw_tie_break(tmp_path, name, expected):
+    path = write(tmp_path, name, ['日時', '種別', '金額', '通貨', '手数料'])
+    assert exchanges.detect(path) == (expected, '')
+
+
+@pytest.mark.parametrize('name', [
+    # zaif is a coin, but here the start of the type
+    'zaif_deposit.csv',
+    'deposit.csv',
+    'xyz_deposit.csv',
+])
+def test_currency_not_in_the_file_name(tmp_path, name):
+    path = write(tmp_path, name, ['日時', '金額'])
+    assert exchanges.detect(path, profits.ProfitCalculator.coins) == ('zaif_deposit', None)
+
+
+def test_unknown_header(tmp_path):
+    assert exchanges.detect(write(tmp_path, 'btc_deposit.csv', ['date', 'amount'])) is None
+
+
+def test_scan_directory(tmp_path, capsys, data_list, fixtures):
+    directory = os.path.join(fixtures, 'history')
+    scanned = profits.scan_directory(directory)
+    # every file of the fixture history, with the currency of its name where the type needs one
+    assert {type: [os.path.basename(item['path']) for item in items] for type, items in scanned.items()} == {
+        type: [os.path.basename(item['path']) for item in items] for type, items in data_list.items()
+    }
+    assert scanned['zaif_deposit'][0]['currency'] == 'btc'
+    capsys.readouterr()
+    write(tmp_path, 'zaif_deposit.csv', ['日時', '金額'])
+    write(tmp_path, 'notes.csv', ['date', 'text'])
+    write(tmp_path, 'doge_deposit.csv', ['日時', '金額'])
+    assert profits.scan_directory(str(tmp_path)) == {}
+    assert profits.scan_directory(str(tmp_path), ['doge']) == {
+        'zaif_deposit': [{'path': os.path.join(str(tmp_path), 'doge_deposit.csv'), 'currency': 'doge'}],
+    }
+    out = capsys.readouterr().out
+    assert 'Unknown csv file: {}'.format(os.path.join(str(tmp_path), 'notes.csv')) in out
+    assert 'Unknown currency' in out and 'zaif_deposit.csv' in out
+
+
+def test_load_directory_equals_data_list(fixtures, fixture_calculator, recorded_prices):
+    cal = fixture_calculator()
+    cal.calculate(verbosity='none')
+    scanned = profits.ProfitCalculator(prices=recorded_prices, offline=True)
+    scanned.load_directory(os.path.join(fixtures, 'history'))
+    scanned.calculate(verbosity='none')
+    assert scanned.snapshot() == cal.snapshot()
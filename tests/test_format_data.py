@@ -0,0 +1,13 @@
+import pandas as pd
+import pytest
+
+import benchmark
+from profits import TradeHistory, csv_types
+
+
+@pytest.mark.parametrize('type', list(csv_types.values()))
+def test_format_data_matches_row_wise_reference(type):
+    data = benchmark.synthetic_frame(type, 50, seed=1)
+    expected = benchmark.format_rows(data, type, 'btc').reset_index(drop=True)
+    actual = TradeHistory().format_data(data, type, 'btc').reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
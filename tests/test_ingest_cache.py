@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import benchmark
+import profits
+
+type = 'zaif_trade'
+
+
+@pytest.fixture
+def rows():
+    return benchmark.synthetic_frame(type, 20, seed=1)
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    # rows parsed by every read of a parser
+    parsed = []
+    get_parser = profits.get_parser
+
+    class Spy:
+        def __init__(self, parser):
+            self.parser = parser
+
+        def __getattr__(self, name):
+            return getattr(self.parser, name)
+
+        def read(self, source, **kwargs):
+            data = self.parser.read(source, **kwargs)
+            parsed.append(len(data))
+            return data
+
+    monkeypatch.setattr(profits, 'get_parser', lambda type: Spy(get_parser(type)))
+    return parsed
+
+
+def write(path, data, append=False):
+    data.to_csv(path, index=False, mode='a' if append else 'w', header=not append)
+
+
+def read(path, directory, entry):
+    return profits.read_cached(((type, path, ''), directory, entry))
+
+
+def assert_full_load(frame, path):
+    pd.testing.assert_frame_equal(frame, profits.read_history((type, path, '')))
+
+
+def test_unchanged_file_is_not_parsed(tmp_path, rows, parsed):
+    path = str(tmp_path / 'trades.csv')
+    write(path, rows)
+    frame, entry = read(path, str(tmp_path), None)
+    assert parsed == [20]
+    cached, same = read(path, str(tmp_path), entry)
+    assert parsed == [20]
+    assert same == entry
+    pd.testing.assert_frame_equal(cached, frame)
+
+
+def test_appended_rows_are_parsed_alone(tmp_path, rows, parsed):
+    path = str(tmp_path / 'trades.csv')
+    write(path, rows[:15])
+    _, entry = read(path, str(tmp_path), None)
+    write(path, rows[15:], append=True)
+    frame, appended = read(path, str(tmp_path), entry)
+    assert parsed == [15, 5]
+    assert appended['rows'] == 20
+    assert_full_load(frame, path)
+
+
+@pytest.mark.parametrize('change', ['shrink', 'edit'])
+def test_other_changes_parse_the_whole_file(tmp_path, rows, parsed, change):
+    path = str(tmp_path / 'trades.csv')
+    write(path, rows[:15])
+    _, entry = read(path, str(tmp_path), None)
+    if change == 'shrink':
+        write(path, rows[:10])
+    else:
+        # an earlier row changes while rows are appended
+        edited = rows.copy()
+        edited.loc[0, '数量'] *= 2
+        write(path, edited)
+    frame, changed = read(path, str(tmp_path), entry)
+    assert parsed == [15, len(frame)]
+    assert changed['rows'] == len(frame)
+    assert_full_load(frame, path)
+
+
+def test_manifest_entries(tmp_path, rows):
+    path = str(tmp_path / 'trades.csv')
+    write(path, rows)
+    directory = str(tmp_path / 'cache')
+    cal = profits.ProfitCalculator(offline=True, prices=profits.LocalPrices())
+    cal.load_history({type: [{'path': path}]}, cache_dir=directory)
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    with open(path, mode='rb') as f:
+        content = f.read()
+    assert list(manifest.values()) == [{
+        'version': profits.IngestCache.version,
+        'type': type,
+        'path': path,
+        'currency': '',
+        'size': len(content),
+        'mtime': os.stat(path).st_mtime_ns,
+        'sha1': hashlib.sha1(content).hexdigest(),
+        'rows': 20,
+    }]
+    # a second load of the unchanged file gives the same history from the cache
+    cached = profits.ProfitCalculator(offline=True, prices=profits.LocalPrices())
+    cached.load_history({type: [{'path': path}]}, cache_dir=directory)
+    pd.testing.assert_frame_equal(cached.trade.data, cal.trade.data)
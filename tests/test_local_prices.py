@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+import profits
+
+# 2018-01-01 00:00 UTC, which is 09:00 in the transaction times, JST read as UTC
+start = 1514764800
+jst = start + 9 * 3600
+
+
+def dump(tmp_path, name, rows, **columns):
+    path = str(tmp_path / name)
+    data = pd.DataFrame(rows, columns=['time', 'close'])
+    for column, value in columns.items():
+        data[column] = value
+    if name.endswith('.parquet'):
+        data.to_parquet(path)
+    else:
+        data.to_csv(path, index=False)
+    return path
+
+
+def test_exact_minutes(tmp_path):
+    prices = profits.LocalPrices()
+    prices.load(dump(tmp_path, 'btc.csv', [(start, 100), (start + 60, 101), (start + 180, 103)]), 'BTC_JPY', 'zaif')
+    assert prices.get('BTC_JPY', 'zaif', jst + 60) == 101
+    # no candle at the minute, and no fallback
+    assert prices.get('BTC_JPY', 'zaif', jst + 120) is None
+    assert prices.get('BTC_JPY', 'bitbank', jst) is None
+    assert prices.get('ETH_JPY', 'zaif', jst) is None
+
+
+@pytest.mark.parametrize('fallback, expected', [(0, None), (60, None), (120, 101), (None, 101)])
+def test_fallback_to_an_earlier_candle(tmp_path, fallback, expected):
+    prices = profits.LocalPrices(fallback=fallback)
+    prices.load(dump(tmp_path, 'btc.csv', [(start, 100), (start + 60, 101), (start + 600, 110)]), 'BTC_JPY', 'zaif')
+    assert prices.get('BTC_JPY', 'zaif', jst + 180) == expected
+    # never a later candle
+    assert prices.get('BTC_JPY', 'zaif', jst - 60) is None
+
+
+@pytest.mark.parametrize('times', [
+    [start * 1000, (start + 60) * 1000 + 999],
+    ['2018-01-01 00:00:00', '2018-01-01 00:01:30'],
+])
+def test_milliseconds_and_datetime_strings(tmp_path, times):
+    prices = profits.LocalPrices()
+    prices.load(dump(tmp_path, 'btc.csv', list(zip(times, [100, 101]))), 'BTC_JPY', 'zaif')
+    assert prices.get('BTC_JPY', 'zaif', jst) == 100
+    assert prices.get('BTC_JPY', 'zaif', jst + 60) == 101
+
+
+def test_offset_of_transaction_times(tmp_path):
+    prices = profits.LocalPrices()
+    prices.load(dump(tmp_path, 'btc.csv', [(start, 100)]), 'BTC_JPY', 'zaif')
+    cal = profits.ProfitCalculator(prices=prices, offline=True)
+    assert cal.get_fair_value(pd.Timestamp('2018-01-01 09:00:30', tz='UTC'), 'BTC_JPY', 'zaif') == 100
+    utc = profits.LocalPrices(offset=0)
+    utc.load(dump(tmp_path, 'btc.csv', [(start, 100)]), 'BTC_JPY', 'zaif')
+    assert utc.get('BTC_JPY', 'zaif', start) == 100
+
+
+def test_later_loads_win(tmp_path):
+    prices = profits.LocalPrices()
+    prices.load(dump(tmp_path, 'a.csv', [(start, 100), (start + 60, 101)]), 'BTC_JPY', 'zaif')
+    assert prices.get('BTC_JPY', 'zaif', jst) == 100
+    prices.load(dump(tmp_path, 'b.csv', [(start + 30, 200), (start + 120, 202)]), 'BTC_JPY', 'zaif')
+    assert prices.get('BTC_JPY', 'zaif', jst) == 200
+    assert prices.get('BTC_JPY', 'zaif', jst + 60) == 101
+    assert prices.get('BTC_JPY', 'zaif', jst + 120) == 202
+    prices.put('BTC_JPY', 'zaif', jst + 60, 301)
+    assert prices.get('BTC_JPY', 'zaif', jst + 60) == 301
+
+
+def test_symbol_and_exchange_columns(tmp_path):
+    prices = profits.LocalPrices()
+    prices.load(dump(tmp_path, 'all.parquet', [(start, 100), (start, 5)], symbol=['BTC_JPY', 'MONA_JPY']))
+    prices.load(dump(tmp_path, 'bitbank.csv', [(start, 99)], symbol='BTC_JPY', exchange='bitbank'))
+    # a chart without an exchange serves every exchange without its own
+    assert prices.get('MONA_JPY', 'bitbank', jst) == 5
+    assert prices.get('BTC_JPY', 'zaif', jst) == 100
+    assert prices.get('BTC_JPY', 'bitbank', jst) == 99
@@ -0,0 +1,72 @@
+import pytest
+
+import profits
+from exchanges import tx_types
+
+
+def test_partial_consumption():
+    lots = profits.Lots()
+    lots.push(1, 100, 1)
+    lots.push(2, 200, 2)
+    assert lots.consume(0.5) == [(1, 0.5, 100)]
+    assert lots.consume(1.5) == [(1, 0.5, 100), (2, 1, 200)]
+    assert len(lots) == 1
+    assert (lots.amount, lots.cost) == pytest.approx((1, 200))
+    # lots run out before the amount
+    assert lots.consume(3) == [(2, 1, 200)]
+    assert len(lots) == 0
+    assert (lots.amount, lots.cost) == (0, 0)
+
+
+def test_grow_wraps_around():
+    lots = profits.Lots(capacity=4)
+    for time in range(3):
+        lots.push(1, time, time)
+    lots.consume(2)
+    # lots 2 to 4 wrap around the end of the buffer, and lot 6 grows it
+    for time in range(3, 7):
+        lots.push(1, time, time)
+    assert len(lots.amounts) == 8
+    assert [time for time, _, _ in lots.consume(5)] == [2, 3, 4, 5, 6]
+
+
+def test_transit_between_wallets():
+    index = profits.LotIndex()
+    index.acquire('btc', 'zaif', 1, 100, 1)
+    index.acquire('btc', 'zaif', 1, 200, 2)
+    index.withdraw('btc', 'zaif', 1.5)
+    assert index.get('btc', 'zaif').amount == pytest.approx(0.5)
+    # the lots in transit come first, and the rest is a new lot at the price given
+    index.deposit('btc', 'bitflyer', 2, 300, 3)
+    assert index.dispose('btc', 'bitflyer', 2) == [(1, 1, 100), (2, 0.5, 200), (3, 0.5, 300)]
+    assert index.average('btc') == pytest.approx(200)
+    index.clear('btc')
+    assert index.average('btc') is None
+
+
+def test_hard_fork_lots(calculate_rows):
+    rows = [
+        ('btc_jpy', '買い', 100, 0, 2, '2017-07-01', 'zaif'),
+        ('bch_jpy', '売り', 300, 0, 1, '2017-09-01', 'zaif'),
+    ]
+    sales = []
+    cal = calculate_rows(rows, track_lots=True, on_sale=lambda row, coin, consumed: sales.append((coin, consumed)))
+    timestamp = cal.hf_timestamps['bch']['timestamp'] * 10 ** 9
+    assert sales == [('bch', [(timestamp, 1, 0)])]
+    assert cal.lots.get('bch', 'zaif').amount == pytest.approx(1)
+
+
+def test_fifo_charges_the_lots_of_sales(fixture_calculator):
+    # the lots passed to on_sale, as --lots writes them, are those FIFO charges
+    sales = []
+    cal = fixture_calculator(cost_basis='fifo')
+    cal.on_sale = lambda row, coin, consumed: sales.append((row, consumed))
+    cal.calculate(verbosity='none')
+    data = cal.trade.data
+    bids = data[(data['type'] == tx_types['BID']) & data['market'].astype(str).str.endswith('_jpy')]
+    sold = [(row, consumed) for row, consumed in sales if row['type'] == tx_types['BID'] and row['market'].endswith('_jpy')]
+    assert len(sold) == len(bids) > 0
+    for (row, consumed), profit in zip(sold, bids['profit']):
+        assert sum(used for _, used, _ in consumed) == pytest.approx(row['amount'])
+        cost = sum(used * price for _, used, price in consumed)
+        assert profit == pytest.approx(row['price'] * row['amount'] - cost)
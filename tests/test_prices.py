@@ -0,0 +1,124 @@
+import time
+
+import pandas as pd
+import pytest
+
+import profits
+from stub_server import StubServer
+
+
+def test_price_store_persists(tmp_path):
+    path = str(tmp_path / 'prices.sqlite3')
+    store = profits.PriceStore(path)
+    store.put_many('BTC_JPY', 'zaif', {60: 1.5, 120: 2.5})
+    store.close()
+    store = profits.PriceStore(path, readonly=True)
+    assert store.get('BTC_JPY', 'zaif', 120) == 2.5
+    assert store.get('BTC_JPY', 'bitbank', 120) is None
+
+
+def test_recorded_store_has_every_fair_value(fixture_calculator):
+    cal = fixture_calculator()
+    assert cal.missing_price_days() == {}
+    cal.calculate(verbosity='none')
+    counters = cal.metrics.counters
+    assert counters['price_requests'] == counters['price_cache_hits'] > 0
+    assert 'price_cache_misses' not in counters
+
+
+def test_prefetch_requests_every_day_once(tmp_path, fixture_calculator):
+    with StubServer() as server:
+        prices = profits.PriceStore(str(tmp_path / 'prices.sqlite3'))
+        cal = server.use(fixture_calculator(prices, fetcher=profits.PriceFetcher(rate=None)))
+        days = len(cal.missing_price_days())
+        assert cal.prefetch_prices() == days == len(server.hits) > 0
+        # everything calculate needs is in the store now
+        assert cal.prefetch_prices() == 0
+        cal.offline = True
+        cal.calculate(verbosity='none')
+        assert len(server.hits) == days
+
+
+def test_total_average_counts_every_key_once(tmp_path, fixture_calculator):
+    with StubServer() as server:
+        prices = profits.PriceStore(str(tmp_path / 'prices.sqlite3'))
+        cal = server.use(fixture_calculator(prices, fetcher=profits.PriceFetcher(rate=None)))
+        cal.total_average()
+        counters = dict(cal.metrics.counters)
+        assert counters['price_cache_misses'] == len(server.hits) > 0
+        assert counters['price_requests'] == counters['price_cache_hits'] + counters['price_cache_misses']
+        # every key is in the store now
+        requests = counters['price_requests']
+        cal.total_average()
+        assert cal.metrics.counters['price_cache_hits'] - counters['price_cache_hits'] == requests
+
+
+def test_no_chart_for_the_exchange():
+    cal = profits.ProfitCalculator(prices=profits.LocalPrices(), offline=True)
+    with pytest.raises(Exception, match='No chart of BTC_JPY on bitflyer'):
+        cal.price_key(pd.Timestamp('2018-01-01', tz='UTC'), 'BTC_JPY', 'bitflyer')
+
+
+def test_failed_bitbank_chart():
+    with StubServer(success=False) as server:
+        cal = server.use(profits.ProfitCalculator(prices=profits.LocalPrices(), fetcher=profits.PriceFetcher(rate=None)))
+        with pytest.raises(Exception, match='No chart of BTC_JPY on 2018-01-01'):
+            cal.fetch_prices('BTC_JPY', 'bitbank', 1514800000)
+
+
+def test_retry_after_429():
+    with StubServer(throttle=2, retry_after=1) as server:
+        fetcher = profits.PriceFetcher(rate=None, backoff=0.01)
+        begin = time.monotonic()
+        response = fetcher.get(server.url + '/zaif', params={'from': 0, 'to': 60})
+        assert response.status_code == 200
+        assert len(server.hits) == 3
+        # Retry-After is waited for instead of the shorter backoff
+        assert time.monotonic() - begin >= 2
+        assert server.hits[2][0] - server.hits[1][0] >= 1
+
+
+def test_gives_up_after_retries():
+    with StubServer(throttle=10) as server:
+        fetcher = profits.PriceFetcher(rate=None, retries=2, backoff=0.01)
+        assert fetcher.get(server.url + '/zaif', params={'from': 0, 'to': 60}).status_code == 429
+        assert len(server.hits) == 3
+
+
+def test_concurrency_bound():
+    with StubServer(latency=0.2) as server:
+        fetcher = profits.PriceFetcher(concurrency=2, rate=None)
+        urls = [server.url + '/btc_jpy/candlestick/1min/2018010{}'.format(day) for day in range(1, 7)]
+        responses = fetcher.map(fetcher.get, urls)
+        assert [response.status_code for response in responses] == [200] * 6
+        assert server.max_in_flight == 2
+
+
+@pytest.mark.parametrize('rate', [10.0, 20.0])
+def test_rate_limit(rate, monkeypatch):
+    with StubServer() as server:
+        fetcher = profits.PriceFetcher(concurrency=4, rate=rate)
+        # times the requests are sent, which connections being made do not delay
+        sent = []
+        get = fetcher.session.get
+
+        def send(*args, **kwargs):
+            sent.append(time.monotonic())
+            return get(*args, **kwargs)
+        monkeypatch.setattr(fetcher.session, 'get', send)
+        urls = [server.url + '/btc_jpy/candlestick/1min/2018010{}'.format(day) for day in range(1, 7)]
+        begin = time.monotonic()
+        fetcher.map(fetcher.get, urls)
+        assert len(server.hits) == 6
+        # the request of every slot is sent after it, one interval of the rate after the one before
+        for i, at in enumerate(sorted(sent)):
+            assert at - begin >= i / rate
+
+
+def test_failed_bitbank_request():
+    # 429 until the retries run out
+    with StubServer(throttle=10) as server:
+        fetcher = profits.PriceFetcher(rate=None, retries=1, backoff=0.01)
+        cal = server.use(profits.ProfitCalculator(prices=profits.LocalPrices(), fetcher=fetcher))
+        with pytest.raises(Exception, match='return status code is 429'):
+            cal.fetch_prices('BTC_JPY', 'bitbank', 1514800000)
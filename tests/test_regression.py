@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import profits
+
+
+@pytest.fixture
+def expected(fixtures):
+    # profit and total_profit of every transaction, as calculated before the replay over plain columns
+    return pd.read_csv(os.path.join(fixtures, 'expected.csv'))
+
+
+def assert_profits(data, expected):
+    assert list(data['market'].astype(str)) == list(expected['market'])
+    assert list(data['type'].astype(str)) == list(expected['type'])
+    np.testing.assert_allclose(data['profit'], expected['profit'], rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(data['total_profit'], expected['total_profit'], rtol=1e-9, atol=1e-6)
+
+
+def test_calculate(expected, fixture_calculator):
+    cal = fixture_calculator()
+    cal.calculate(verbosity='none')
+    assert_profits(cal.trade.data, expected)
+
+
+def test_resume(expected, tmp_path, fixture_calculator):
+    cal = fixture_calculator(checkpoint_dir=str(tmp_path))
+    cal.calculate(verbosity='none', checkpoint_every=50)
+    cal = fixture_calculator(checkpoint_dir=str(tmp_path))
+    cal.calculate(verbosity='none', resume=True)
+    assert_profits(cal.trade.data, expected)
+
+
+def test_calculate_years(expected, tmp_path, fixture_calculator):
+    # the first run writes the checkpoints at year boundaries, the second replays years in parallel
+    for _ in range(2):
+        cal = fixture_calculator(checkpoint_dir=str(tmp_path))
+        cal.calculate_years(workers=2, verbosity='none')
+        assert_profits(cal.trade.data, expected)
+
+
+def test_checkpoints_of_other_methods_are_kept(tmp_path, fixture_calculator):
+    fifo = fixture_calculator(checkpoint_dir=str(tmp_path), cost_basis='fifo')
+    fifo.calculate(verbosity='none')
+    kept = sorted(path for _, _, path in fifo.checkpoints())
+    assert len(kept) > 0
+    cal = fixture_calculator(checkpoint_dir=str(tmp_path))
+    cal.calculate_years(workers=2, verbosity='none')
+    cal = fixture_calculator(checkpoint_dir=str(tmp_path))
+    cal.trade.data.loc[0, 'amount'] *= 2
+    cal.calculate(verbosity='none', resume=True)
+    assert sorted(path for _, _, path in fifo.checkpoints()) == kept
+    resumed = fixture_calculator(checkpoint_dir=str(tmp_path), cost_basis='fifo')
+    resumed.calculate(verbosity='none', resume=True)
+    assert resumed.snapshot() == fifo.snapshot()
+
+
+def test_calculate_years_of_an_empty_history(tmp_path, fake_prices):
+    cal = profits.ProfitCalculator(prices=fake_prices(), offline=True, checkpoint_dir=str(tmp_path))
+    cal.trade.concat_data([])
+    cal.calculate_years(workers=2, verbosity='none')
+    empty = profits.ProfitCalculator(prices=fake_prices(), offline=True)
+    empty.trade.concat_data([])
+    empty.calculate(verbosity='none')
+    assert cal.snapshot() == empty.snapshot()
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+import profits
+
+
+def test_stream_equals_calculate(data_list, recorded_prices, fixture_calculator):
+    cal = fixture_calculator()
+    cal.calculate(verbosity='none')
+    stream = profits.ProfitCalculator(prices=recorded_prices, offline=True)
+    rows = []
+    stream.calculate_stream(
+        profits.stream_history(data_list, chunksize=50, prepare=stream.prepare),
+        verbosity='none', on_row=rows.append,
+    )
+    np.testing.assert_allclose([row['profit'] for row in rows], cal.trade.data['profit'])
+    np.testing.assert_allclose([row['total_profit'] for row in rows], cal.trade.data['total_profit'])
+    assert stream.snapshot() == cal.snapshot()
+
+
+def test_stream_takes_bitbank_charts_from_the_history(tmp_path, fake_prices):
+    # XRP is bought with BTC on Bitbank before any XRP_JPY trade there
+    path = str(tmp_path / 'bitbank.csv')
+    pd.DataFrame({
+        '取引日時': ['2018-01-01 10:00:00', '2018-01-02 10:00:00', '2018-01-03 10:00:00'],
+        '売/買': ['buy', 'buy', 'sell'],
+        '価格': [1000000, 0.0001, 150],
+        '通貨ペア': ['btc_jpy', 'xrp_btc', 'xrp_jpy'],
+        '数量': [1, 100, 50],
+        '手数料': [0, 0, 0],
+    }).to_csv(path, index=False)
+    data_list = {'bitbank': [{'path': path}]}
+    cal = profits.ProfitCalculator(prices=fake_prices(), offline=True)
+    cal.load_history(data_list)
+    cal.calculate(verbosity='none')
+    stream = profits.ProfitCalculator(prices=fake_prices(), offline=True)
+    stream.calculate_stream(profits.stream_history(data_list, prepare=stream.prepare), verbosity='none')
+    assert ('XRP_JPY', 'bitbank') in cal.prices.charts
+    assert stream.prices.charts == cal.prices.charts
+    assert stream.snapshot() == cal.snapshot()